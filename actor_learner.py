@@ -0,0 +1,265 @@
+import multiprocessing
+import Queue
+import sys
+import time
+import numpy as np
+from board import Board, DiceStream
+from player import Player
+from neural_net import NeuralNetwork
+from backgammon import Backgammon
+
+
+class Trajectory(object):
+    """ Inputs of one self-play game, in the order the players learn from
+        them. A move is the input of the board before and of the board
+        chosen, both seen from the moving player. The final boards come
+        with the actual outputs of the players who won and lost. """
+
+    def __init__(self):
+        self.currents = []
+        self.chosen = []
+        # (input, actual output, won)
+        self.finals = []
+
+    def add_move(self, current_input, chosen_input):
+        self.currents.append(current_input)
+        self.chosen.append(chosen_input)
+
+    def add_final(self, final_input, actual_output, won):
+        self.finals.append((final_input, actual_output, won))
+
+    def pack(self):
+        """ Returns the trajectory as arrays, which pickle compactly. """
+        self.currents = np.array(self.currents, dtype=float)
+        self.chosen = np.array(self.chosen, dtype=float)
+        return self
+
+    def __len__(self):
+        return len(self.currents)
+
+
+class RecordingPlayer(Player):
+    """ Frozen player, which records what a learning player would
+        learn from in a shared Trajectory. """
+
+    def __init__(self, color, neural_network, trajectory=None):
+        super(RecordingPlayer, self).__init__(color, neural_network, learning_mode=False)
+        self.trajectory = trajectory
+
+    def choose_move(self, backgammon, time_budget=None):
+        best_board = super(RecordingPlayer, self).choose_move(backgammon, time_budget)
+        self.trajectory.add_move(self.board_to_vector(backgammon.board), \
+                                    self.board_to_vector(best_board))
+        return best_board
+
+    def get_actual_output(self, won):
+        """ Returns the reward of the game, as in Player.won() and lost(). """
+        white_won = (won == (self.get_perspective() == Board.WHITE))
+        return ([1.0, 0.0] if white_won else [0.0, 1.0])
+
+    def lost(self, final_board):
+        self.trajectory.add_final(self.board_to_vector(final_board), \
+                                    self.get_actual_output(False), False)
+
+    def won(self, final_board):
+        self.trajectory.add_final(self.board_to_vector(final_board), \
+                                    self.get_actual_output(True), True)
+
+
+def get_weights(neural_network):
+    """ Returns all weights of the network as one flat array. """
+    neural_network.flush_weights()
+    return np.hstack([neural_network.layer_dict[key].weights.ravel() \
+                        for key in ('hidden', 'output')])
+
+
+def set_weights(neural_network, weights):
+    """ Copies the flat array of get_weights() into the network. """
+    start = 0
+    for key in ('hidden', 'output'):
+        layer_weights = neural_network.layer_dict[key].weights
+        layer_weights[:] = weights[start:start + layer_weights.size].reshape( \
+                                                            layer_weights.shape)
+        start += layer_weights.size
+    neural_network.weights_version += 1
+
+
+def run_actor(actor_id, sizes, shared_weights, published_version, queue, stop, \
+                    num_games, num_moves, blocked_time, seed, refresh_every):
+    """ Actor process: plays self-play games with a copy of the published
+        weights and puts their trajectories into the queue. The copy is
+        refreshed every refresh_every games, when a newer version was
+        published. Blocks while the queue is full. """
+    network = NeuralNetwork(*sizes)
+    version = None
+    players = [RecordingPlayer(color, network) for color in (Board.WHITE, Board.BLACK)]
+    bg = Backgammon(training_mode=False, restore_net=False, players=players, \
+                    seed=DiceStream.derive_seed(seed, 'actor', actor_id))
+
+    game = 0
+    while not stop.is_set():
+        if game % refresh_every == 0 and version != published_version.value:
+            with shared_weights.get_lock():
+                version = published_version.value
+                set_weights(network, np.frombuffer(shared_weights.get_obj()))
+
+        # a queued trajectory is pickled later by the feeder thread of the
+        # queue, so every game records into a new one
+        trajectory = Trajectory()
+        for player in players:
+            player.trajectory = trajectory
+        bg.reset(game_index=game)
+        bg.run()
+        game += 1
+
+        # backpressure: wait for the learner while the queue is full
+        start = time.time()
+        while not stop.is_set():
+            try:
+                queue.put(trajectory.pack(), timeout=0.1)
+                break
+            except Queue.Full:
+                pass
+        with blocked_time.get_lock():
+            blocked_time.value += time.time() - start
+        with num_games.get_lock():
+            num_games.value += 1
+            num_moves.value += len(trajectory)
+
+
+class ActorLearner(object):
+    """ Self-play training with separate actor processes. The actors play
+        with frozen copies of the weights and stream trajectories through
+        a bounded queue, the learner in this process runs the TD(lambda)
+        updates of Player, in the same order, and publishes its weights
+        every publish_every games. The actors follow the learner with a
+        lag of up to a few published versions. """
+
+    def __init__(self, neural_network, num_actors=None, queue_size=16, \
+                    publish_every=10, refresh_every=1, seed=None):
+        self.neural_network = neural_network
+        self.num_actors = (num_actors if num_actors is not None \
+                            else max(1, multiprocessing.cpu_count() - 1))
+        self.queue_size = queue_size
+        self.publish_every = publish_every
+        self.refresh_every = refresh_every
+        self.seed = (seed if seed is not None else DiceStream().seed)
+
+        weights = get_weights(neural_network)
+        self.shared_weights = multiprocessing.Array('d', len(weights))
+        self.published_version = multiprocessing.Value('i', 0)
+        self.publish()
+        self.queue = multiprocessing.Queue(queue_size)
+        self.stop = multiprocessing.Event()
+        # counters of the actors
+        self.actor_games = multiprocessing.Value('i', 0)
+        self.actor_moves = multiprocessing.Value('i', 0)
+        self.actor_blocked_time = multiprocessing.Value('d', 0.0)
+        # counters of the learner
+        self.learner_games = 0
+        self.learner_steps = 0
+        self.learner_wait_time = 0.0
+        self.max_queue_depth = 0
+        self.start_time = None
+
+    def publish(self):
+        """ Makes the current weights of the learner available to the actors. """
+        with self.shared_weights.get_lock():
+            np.frombuffer(self.shared_weights.get_obj())[:] = \
+                                            get_weights(self.neural_network)
+            self.published_version.value += 1
+
+    def learn(self, trajectory):
+        """ Runs the updates, which the learning players would have run
+            during the game. """
+        network = self.neural_network
+        for current_input, chosen_input in zip(trajectory.currents, trajectory.chosen):
+            next_output = network.get_network_output(chosen_input)
+            current_output = network.get_network_output(current_input)
+            network.back_prop(current_output, next_output)
+
+        for final_input, actual_output, won in trajectory.finals:
+            current_output = network.get_network_output(final_input)
+            network.back_prop(current_output, actual_output)
+            network.reset_all_traces()
+            if won:
+                network.update_counter()
+
+        self.learner_games += 1
+        self.learner_steps += len(trajectory) + len(trajectory.finals)
+
+    def run(self, num_games, report_every=None):
+        """ Trains on num_games games of the actors, returns the stats. """
+        actors = [multiprocessing.Process(target=run_actor, \
+                    args=(actor_id, (self.neural_network.input_size, \
+                                    self.neural_network.hidden_size, \
+                                    self.neural_network.output_size), \
+                          self.shared_weights, self.published_version, self.queue, \
+                          self.stop, self.actor_games, self.actor_moves, \
+                          self.actor_blocked_time, self.seed, self.refresh_every)) \
+                    for actor_id in range(self.num_actors)]
+        for actor in actors:
+            actor.daemon = True
+            actor.start()
+
+        self.start_time = time.time()
+        try:
+            while self.learner_games < num_games:
+                self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+                start = time.time()
+                trajectory = self.queue.get()
+                self.learner_wait_time += time.time() - start
+
+                self.learn(trajectory)
+                if self.learner_games % self.publish_every == 0:
+                    self.publish()
+                if report_every and self.learner_games % report_every == 0:
+                    print self.format_stats()
+        finally:
+            self.stop.set()
+            # unblock actors waiting for a free slot
+            while any(actor.is_alive() for actor in actors):
+                try:
+                    self.queue.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+            for actor in actors:
+                actor.join()
+
+        return self.get_stats()
+
+    def get_stats(self):
+        seconds = max(time.time() - self.start_time, 1e-9)
+        return {'seconds': seconds, \
+                'actors': self.num_actors, \
+                'actor_games_per_second': self.actor_games.value / seconds, \
+                'actor_moves_per_second': self.actor_moves.value / seconds, \
+                'actor_blocked_fraction': self.actor_blocked_time.value / \
+                                                (seconds * self.num_actors), \
+                'learner_games_per_second': self.learner_games / seconds, \
+                'learner_steps_per_second': self.learner_steps / seconds, \
+                'learner_wait_fraction': self.learner_wait_time / seconds, \
+                'queue_depth': self.queue.qsize(), \
+                'max_queue_depth': self.max_queue_depth, \
+                'published_versions': self.published_version.value}
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return "actors: {actor_games_per_second:.2f} games/s, blocked " \
+               "{actor_blocked_fraction:.0%} | learner: {learner_games_per_second:.2f} " \
+               "games/s, waiting {learner_wait_fraction:.0%} | queue: " \
+               "{queue_depth}/{max_queue_depth}".format(**stats)
+
+
+if __name__ == '__main__':
+    num_games = (int(sys.argv[1]) if len(sys.argv) > 1 else 100)
+    num_actors = (int(sys.argv[2]) if len(sys.argv) > 2 else None)
+
+    network = NeuralNetwork(restore_from_file=True)
+    network.enable_sparse_traces()
+    print "Network experience: %s games" %(network.num_games)
+
+    actor_learner = ActorLearner(network, num_actors)
+    actor_learner.run(num_games, report_every=10)
+    network.save_network()
+    print actor_learner.format_stats()
@@ -0,0 +1,81 @@
+from board import Board
+
+
+class Adjudicator(object):
+    """ Rules to end games early, whose outcome is decided, eg evaluation
+        games which would otherwise be played out for many more moves.
+            race: there is no more contact and the pip count lead of one
+                side is at least race_lead times its own pip count and
+                at least min_lead pips, after adding half a roll for the
+                side on roll.
+            closeout: one side has all its checkers in its home board,
+                holds all six home points and at least one checker of the
+                opponent is on the bar, which is behind in the pip count.
+        Both rules are estimates, the adjudicated side wins nearly all of
+        these games when they are played out. """
+
+    RACE = 'race'
+    CLOSEOUT = 'closeout'
+
+    # about half of the average roll of 8.17 pips
+    ON_ROLL_PIPS = 4
+
+    def __init__(self, race_lead=0.3, min_lead=20, closeout=True):
+        self.race_lead = race_lead
+        self.min_lead = min_lead
+        self.closeout = closeout
+        # counters, rule -> number of adjudicated games
+        self.num_adjudicated = {self.RACE: 0, self.CLOSEOUT: 0}
+
+    def adjudicate(self, board, player_on_roll):
+        """ Returns the color of the winner and the deciding rule, or None
+            if the game has to be played on. """
+        result = self.check_race(board, player_on_roll)
+        if result is None and self.closeout:
+            result = self.check_closeout(board)
+        if result is not None:
+            self.count(result[1])
+        return result
+
+    def count(self, rule, num_games=1):
+        """ Counts games adjudicated by rule, nothing for rule None. Used
+            to total the games of worker processes, which count in copies. """
+        if rule is not None:
+            self.num_adjudicated[rule] += num_games
+
+    def check_race(self, board, player_on_roll):
+        if not board.is_race():
+            return None
+
+        pips = {}
+        for color in (Board.WHITE, Board.BLACK):
+            pips[color] = board.get_pipcount(color)
+        pips[player_on_roll] -= self.ON_ROLL_PIPS
+
+        leader = (Board.WHITE if pips[Board.WHITE] < pips[Board.BLACK] else Board.BLACK)
+        lead = pips[Board.get_opponent(leader)] - pips[leader]
+        if lead >= max(self.min_lead, self.race_lead * pips[leader]):
+            return leader, self.RACE
+        return None
+
+    def check_closeout(self, board):
+        for color in (Board.WHITE, Board.BLACK):
+            opponent = Board.get_opponent(color)
+            if board.get_bar(opponent) == 0 or board.get_bar(color) > 0:
+                continue
+            if board.get_pipcount(color) >= board.get_pipcount(opponent):
+                continue
+
+            # all checkers at home and all home points made
+            home_points = [i for i in range(Board.NUM_POINTS) \
+                                if Board.in_home_board(color, i)]
+            checkers_home = sum(board.get_checkers(i, color) for i in home_points)
+            if checkers_home + board.get_off(color) < Board.NUM_CHECKERS:
+                continue
+            if all(board.get_checkers(i, color) >= 2 for i in home_points):
+                return color, self.CLOSEOUT
+        return None
+
+    def __repr__(self):
+        return "Adjudicator, {} race and {} closeout games".format( \
+                    self.num_adjudicated[self.RACE], self.num_adjudicated[self.CLOSEOUT])
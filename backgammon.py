@@ -1,4 +1,4 @@
-from board import Board, Dice
+from board import Board, Dice, DiceStream
 from player import Player, RandomPlayer
 from neural_net import NeuralNetwork
 import sys
@@ -9,21 +9,39 @@ class Backgammon(object):
         two players, execute backgammon.run(), which runs the game, and
         the call backgammon.reset(), backgammon.run() if you
         want to play again. """
-    def __init__(self, training_mode, restore_net):
+    def __init__(self, training_mode, restore_net, players=None, seed=None, \
+                                                            adjudicator=None):
+        """ players can be a list of a white and a black player, which
+            then play instead of the default players of the mode.
+            With a seed the dice of each game come from a DiceStream derived
+            from (seed, game index), so every game can be replayed.
+            An Adjudicator ends games early, once their outcome is decided,
+            there is none by default, so training games are played out. """
         # the dice
         self.dice = Dice()
+        # seed of all games of this instance and index of the next game
+        self.seed = seed
+        self.next_game_index = 0
+        # seed, game index and result of the current game
+        self.game_record = None
+        # rules to end decided games early
+        self.adjudicator = adjudicator
         # internal board, which is the state before the current move
         self.board = Board()
         
         # the neural network used by the players, both players share the same net
-        if not restore_net:
+        if players is not None:
+            self.neural_network = getattr(players[0], 'neural_network', None)
+        elif not restore_net:
             self.neural_network = NeuralNetwork(input_size=198, hidden_size=40, \
                                                                 output_size=2)
         elif restore_net:
             self.neural_network = NeuralNetwork(restore_from_file=True)
         
         # list of players
-        if training_mode:
+        if players is not None:
+            self.players = list(players)
+        elif training_mode:
             self.players = [Player('white', self.neural_network, learning_mode=True), \
                             Player('black', self.neural_network, learning_mode=True)]
         # let white play against RandomPlayer black for evaluating performance
@@ -42,11 +60,29 @@ class Backgammon(object):
         """ Saves the Neural Network of this Backgammon instance to a file. """
         self.neural_network.save_network()
     
-    def reset(self):
+    def reset(self, game_index=None):
         """ Resets this backgammon instance to the initial state, with
-            a new board and determines starting player. """
+            a new board and determines starting player. With a seed,
+            game_index selects the game to play, eg to replay it. """
+        if game_index is None:
+            game_index = self.next_game_index
+        self.next_game_index = game_index + 1
+        self.game_record = {'seed': self.seed, 'game_index': game_index, \
+                            'winner': None, 'num_moves': 0, 'adjudicated': None}
+
+        if self.seed is not None:
+            stream = DiceStream(self.seed).for_game(game_index)
+            self.dice = Dice(stream)
+            # players with random choices replay them as well
+            for player in self.players:
+                if hasattr(player, 'reseed'):
+                    player.reseed(DiceStream.derive_seed(stream.seed, 'player', \
+                                                            player.color))
+
         self.board.reset_board()
         self.dice.roll()
+        # white first, the order may have been reversed by the last game
+        self.players.sort(key=lambda player: player.color)
         
         # decide which player starts the game by rolling dice
         # die1 > die2 player 0 starts and vice versa
@@ -75,41 +111,53 @@ class Backgammon(object):
     def run(self):
         """ Runs a game of backgammon, and does not return until the game
             is over. Returns the player who won the game. """
-        while not self.board.is_gameover():
+        winner_color = None
+        while winner_color is None:
             # request players to choose a board
-            self.get_move(self.players[0])
-            if self.board.is_gameover():
-                break
+            for player in self.players:
+                self.get_move(player)
+                winner_color = self.get_decided_winner(player)
+                if winner_color is not None:
+                    break
 
-            self.get_move(self.players[1])
-            if self.board.is_gameover():
-                break
+        self.finish(winner_color)
+        return self.winner
 
+    def get_decided_winner(self, player):
+        """ Returns the color of the winner after player moved, if the game
+            is over or was adjudicated, otherwise None. """
         # check whether a player has all checkers beared off
-        # and return it as winner. 
-        if self.board.get_off(Board.WHITE) == 15:
-            for player in self.players:
-                if player.color == Board.WHITE:
-                    player.won(self.board)
-                    self.winner = player
-                else:
-                    player.lost(self.board)
-        
-        elif self.board.get_off(Board.BLACK) == 15:
-            for player in self.players:
-                if player.color == Board.BLACK:
-                    player.won(self.board)
-                    self.winner = player
-                else:
-                    player.lost(self.board)
-        
-        return self.winner
+        for color in (Board.WHITE, Board.BLACK):
+            if self.board.get_off(color) == Board.NUM_CHECKERS:
+                return color
+
+        if self.adjudicator is not None:
+            result = self.adjudicator.adjudicate(self.board, \
+                                                Board.get_opponent(player.color))
+            if result is not None:
+                winner_color, rule = result
+                self.game_record['adjudicated'] = rule
+                return winner_color
+        return None
+
+    def finish(self, winner_color):
+        """ Lets the players learn the result of the game
+            and records the winner. """
+        for player in self.players:
+            if player.color == winner_color:
+                player.won(self.board)
+                self.winner = player
+            else:
+                player.lost(self.board)
+
+        self.game_record['winner'] = winner_color
         
     def get_move(self, player):
         """ Receives a board from the player and applies the move. """
         #print player.color
         new_board = player.choose_move(self)
         self.apply_move(new_board)
+        self.game_record['num_moves'] += 1
 
     def apply_move(self, new_board):
         """ Updates the board according to chosen move
@@ -137,6 +185,8 @@ class Backgammon(object):
 if __name__ == '__main__':
         
     bg = Backgammon(training_mode=True, restore_net=True)
+    # same updates as the dense back_prop, but only for the active inputs
+    bg.neural_network.enable_sparse_traces()
     wins = [0,0]
     n_games = 10
     
@@ -0,0 +1,140 @@
+import multiprocessing
+import random
+import resource
+import sys
+import time
+import numpy as np
+from board import Board, Dice, DiceStream
+from move import BoardFactory
+from player import Player
+from neural_net import NeuralNetwork
+from backgammon import Backgammon
+from evaluation import duplicate_match
+
+
+def learning_curve(batch_size=None, num_games=1000, eval_every=100, eval_pairs=50, \
+                    seed=0, alpha=NeuralNetwork.ALPHA, beta=NeuralNetwork.BETA):
+    """ Trains a new network by self-play, with per-move updates when
+        batch_size is None and with mini-batch TD(lambda) otherwise. Every
+        eval_every games the network plays a duplicate match against
+        RandomPlayer. Returns a list of (games, training seconds, win rate).
+        The initial weights, training dice and evaluation dice only depend
+        on seed, so the curves of different batch sizes are comparable. """
+    np.random.seed(seed)
+    network = NeuralNetwork(input_size=198, hidden_size=40, output_size=2)
+    if batch_size is None:
+        network.enable_sparse_traces()
+    else:
+        network.enable_batch_updates(batch_size, alpha, beta)
+
+    players = [Player('white', network, learning_mode=True), \
+               Player('black', network, learning_mode=True)]
+    bg = Backgammon(training_mode=True, restore_net=False, players=players, \
+                    seed=DiceStream.derive_seed(seed, 'training'))
+    eval_seed = DiceStream.derive_seed(seed, 'evaluation')
+
+    curve = []
+    seconds = 0.0
+    for game in range(1, num_games + 1):
+        start = time.time()
+        bg.reset(game_index=game)
+        bg.run()
+        seconds += time.time() - start
+
+        if game % eval_every == 0:
+            result = duplicate_match(network, eval_pairs, eval_seed)
+            curve.append((game, seconds, result.win_rate))
+    return curve
+
+
+def compare_learning_curves(batch_sizes=(None, 16, 64, 256), **options):
+    """ Prints the learning curves of per-move updates (None)
+        and of the given mini-batch sizes side by side. """
+    curves = {}
+    for batch_size in batch_sizes:
+        curves[batch_size] = learning_curve(batch_size, **options)
+
+    names = [("per move" if size is None else "batch %s" % size) for size in batch_sizes]
+    print "%8s" % "games" + "".join("%20s" % name for name in names)
+    for row in range(len(curves[batch_sizes[0]])):
+        games = curves[batch_sizes[0]][row][0]
+        cells = ["%11.3f (%5.0fs)" % (curves[size][row][2], curves[size][row][1]) \
+                    for size in batch_sizes]
+        print "%8s" % games + "".join("%20s" % cell for cell in cells)
+    return curves
+
+
+def sample_positions(num_positions=200, seed=0):
+    """ Returns (player, dice, board) of positions with doubles to play,
+        from random games. Doubles with many checkers in play have the
+        most boards per move. """
+    stream = DiceStream(DiceStream.derive_seed(seed, 'positions'))
+    choices = random.Random(seed)
+    positions = []
+    while len(positions) < num_positions:
+        board = Board()
+        player = Board.WHITE
+        while not board.is_gameover() and len(positions) < num_positions:
+            dice = Dice(stream)
+            dice.roll()
+            if dice.is_doubles():
+                positions.append((player, dice, Board(board)))
+            board = choices.choice(BoardFactory.generate_all_boards(player, dice, board))
+            player = Board.get_opponent(player)
+    return positions
+
+
+def measure_move_memory(positions, chunk_size, connection):
+    """ Child process of move_memory(): generates the boards of all
+        positions and sends the growth of the peak resident memory in KB,
+        the seconds and the largest number of boards alive at once. """
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_alive = 0
+    start = time.time()
+    for player, dice, board in positions:
+        if chunk_size is None:
+            all_boards = BoardFactory.generate_all_boards(player, dice, board)
+            max_alive = max(max_alive, len(all_boards))
+            all_boards = None
+        else:
+            for chunk in BoardFactory.iter_board_chunks(player, dice, board, chunk_size):
+                max_alive = max(max_alive, len(chunk))
+    seconds = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    connection.send((peak, seconds, max_alive))
+    connection.close()
+
+
+def move_memory(chunk_sizes=(None, 64, 16), num_positions=200, seed=0):
+    """ Prints the peak memory of generating the boards of doubles with
+        generate_all_boards() (None) and with streaming chunks of the given
+        sizes. Each mode runs in a fresh process, as the peak resident memory
+        of a process never goes down. Returns mode -> (KB, seconds, boards). """
+    positions = sample_positions(num_positions, seed)
+    results = {}
+    print "%10s%12s%10s%14s" % ("mode", "peak KB", "seconds", "boards alive")
+    for chunk_size in chunk_sizes:
+        receiver, sender = multiprocessing.Pipe(False)
+        process = multiprocessing.Process(target=measure_move_memory, \
+                                            args=(positions, chunk_size, sender))
+        process.start()
+        results[chunk_size] = receiver.recv()
+        process.join()
+
+        name = ("list" if chunk_size is None else "chunk %s" % chunk_size)
+        print "%10s%12s%10.2f%14s" % ((name,) + results[chunk_size])
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'memory':
+        num_positions = (int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+        print "Peak memory of the boards of %s doubles:" % num_positions
+        move_memory(num_positions=num_positions)
+        sys.exit()
+
+    num_games = (int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
+    eval_every = (int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+
+    print "Win rate against RandomPlayer (training time) after n games:"
+    compare_learning_curves(num_games=num_games, eval_every=eval_every)
@@ -12,4 +12,16 @@ class BackgammonException(Exception):
 class IllegalMoveException(BackgammonException):
 	""" Exceptions related to wrong or not possible moves. """
 	def __init__(self, msg):
-		super(IllegalMoveException, self).__init__(msg)
\ No newline at end of file
+		super(IllegalMoveException, self).__init__(msg)
+
+
+class SearchTimeoutException(BackgammonException):
+	""" Raised when a move search runs out of its time budget. """
+	def __init__(self, msg):
+		super(SearchTimeoutException, self).__init__(msg)
+
+
+class ProtocolException(BackgammonException):
+	""" Malformed or unexpected messages between processes. """
+	def __init__(self, msg):
+		super(ProtocolException, self).__init__(msg)
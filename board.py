@@ -1,8 +1,60 @@
 from random import randint
+import base64
 import copy
+import hashlib
+import os
+import numpy as np
 from bgexceptions import BackgammonException, IllegalMoveException
 
 
+class DiceStream(object):
+    """ Reproducible source of dice rolls. The rolls are drawn in blocks
+        from a NumPy RandomState seeded with seed. Independent streams,
+        eg for worker processes or single games, are derived from the
+        seed by hashing, so a game can be replayed from (seed, game index). """
+
+    # number of rolls drawn at once
+    BLOCK_SIZE = 1024
+    # RandomState takes 32 bit seeds
+    MAX_SEED = 2**32
+
+    def __init__(self, seed=None, block_size=BLOCK_SIZE):
+        if seed is None:
+            seed = DiceStream.derive_seed(os.urandom(16))
+        self.seed = seed
+        self.block_size = block_size
+        self.random_state = np.random.RandomState(seed)
+        self.block = None
+        self.position = block_size
+
+    @staticmethod
+    def derive_seed(seed, *keys):
+        """ Returns a 32 bit seed derived from seed and the provided keys,
+            eg derive_seed(seed, 'game', 7). """
+        digest = hashlib.sha1(repr((seed,) + keys)).hexdigest()
+        return int(digest[:8], 16) % DiceStream.MAX_SEED
+
+    def spawn(self, num_streams):
+        """ Returns independent streams, eg one per worker process. """
+        return [DiceStream(DiceStream.derive_seed(self.seed, 'spawn', i), \
+                            self.block_size) for i in range(num_streams)]
+
+    def for_game(self, game_index):
+        """ Returns the stream of the game with the given index. """
+        return DiceStream(DiceStream.derive_seed(self.seed, 'game', game_index), \
+                            self.block_size)
+
+    def next_roll(self):
+        """ Returns the next roll as a list of two dice. """
+        if self.position >= self.block_size:
+            self.block = self.random_state.randint(Dice.MIN_VALUE, Dice.MAX_VALUE + 1, \
+                                                    size=(self.block_size, Dice.NUM_DICE))
+            self.position = 0
+        die1, die2 = self.block[self.position]
+        self.position += 1
+        return [int(die1), int(die2)]
+
+
 class Dice(object):
     """ Roll da dice! """   
     
@@ -11,15 +63,21 @@ class Dice(object):
     MAX_VALUE = 6
     NUM_DICE = 2
     
-    def __init__(self):
+    def __init__(self, stream=None):
+        """ Rolls are drawn from stream, a DiceStream, if provided and
+            from the global random module otherwise. """
         self.dice = [None, None]
+        self.stream = stream
         #self.roll(die1, die2)
 
     def roll(self, die1=None, die2=None):
         """ Roll the dice. """
         # returns tuple of random numbers with 0 <= number < MAX_VALUE
         if die1 is None and die2 is None:
-            self.dice = [randint(Dice.MIN_VALUE, Dice.MAX_VALUE),
+            if self.stream is not None:
+                self.dice = self.stream.next_roll()
+            else:
+                self.dice = [randint(Dice.MIN_VALUE, Dice.MAX_VALUE),
                                 randint(Dice.MIN_VALUE, Dice.MAX_VALUE)]
             return self.dice
         else:
@@ -27,6 +85,16 @@ class Dice(object):
             self.dice[1] = die2
             return self.dice
 
+    @staticmethod
+    def distinct_rolls():
+        """ Returns the 21 distinct rolls as (die1, die2, probability),
+            non-doubles are twice as likely as doubles. """
+        rolls = []
+        for die1 in range(Dice.MIN_VALUE, Dice.MAX_VALUE + 1):
+            for die2 in range(die1, Dice.MAX_VALUE + 1):
+                rolls.append((die1, die2, (1 if die1 == die2 else 2) / 36.0))
+        return rolls
+
     def get_dice(self):
         return self.dice
         
@@ -66,6 +134,18 @@ class Board(object):
     INITIAL_LOCATIONS = [0, 5, 7, 11, 12, 16, 18, 23]
     INITIAL_NUMOFCHECKERS = [2, 5, 3, 5, 5, 3, 5, 2]
     INITIAL_COLORS = [WHITE, BLACK, BLACK, WHITE, BLACK, WHITE, WHITE, BLACK]
+    # number of checkers each player starts with
+    NUM_CHECKERS = 15
+
+    # pseudo locations of move steps, which start on the bar or end off the board
+    BAR_LOCATION = 24
+    OFF_LOCATION = 25
+    # move steps are encoded as start * STEP_BASE + end
+    STEP_BASE = 26
+
+    # gnubg-style position IDs: 80 bits, ie 10 bytes, or 14 base64 characters
+    POSITION_ID_LENGTH = 10
+    POSITION_ID_STRING_LENGTH = 14
     
     # "Constructor" for instance variables unique
     # to each instance like x = Board()
@@ -76,7 +156,9 @@ class Board(object):
             self.colors = None
             self.bar = None
             self.off = None
-            self.move_history = []
+            # moves of the current turn, see add_move_step()
+            self.move_steps = None
+            self.num_moves = 0
             self.reset_board()
         else:
             # way faster than copy.deepcopy()
@@ -84,7 +166,9 @@ class Board(object):
             self.colors = list(other_board.colors)
             self.bar = list(other_board.bar)
             self.off = list(other_board.off)
-            self.move_history = list(other_board.move_history)
+            # the move steps are immutable and shared with other_board
+            self.move_steps = other_board.move_steps
+            self.num_moves = other_board.num_moves
             # self.board = copy.deepcopy(other_board.get_board())
             # self.colors = copy.deepcopy(other_board.get_colors())
             # self.bar = copy.deepcopy(other_board.bar)
@@ -102,11 +186,38 @@ class Board(object):
             self.board[loc] = Board.INITIAL_NUMOFCHECKERS[i]
             self.colors[loc] = Board.INITIAL_COLORS[i]
 
-    def update_move_history(self, move_string):
-        self.move_history.append(move_string)
+    def add_move_step(self, start, end):
+        """ Records a checker move of the current turn. start may be
+            BAR_LOCATION and end OFF_LOCATION. The steps are kept as a
+            linked list of (previous steps, step) tuples, so boards
+            derived from each other share their common steps. """
+        self.move_steps = (self.move_steps, start * Board.STEP_BASE + end)
+        self.num_moves += 1
 
     def reset_move_history(self):
-        self.move_history = []
+        self.move_steps = None
+        self.num_moves = 0
+
+    def get_move_steps(self):
+        """ Returns the (start, end) locations of the moves of this turn. """
+        steps = []
+        node = self.move_steps
+        while node is not None:
+            node, step = node
+            steps.append(divmod(step, Board.STEP_BASE))
+        steps.reverse()
+        return steps
+
+    @property
+    def move_history(self):
+        """ Returns the moves of this turn as text, eg ['bar --> 3', '8 --> 5']. """
+        history = []
+        for start, end in self.get_move_steps():
+            history.append("%s --> %s" %(("bar" if start == Board.BAR_LOCATION \
+                                                    else start + 1), \
+                                          ("off" if end == Board.OFF_LOCATION \
+                                                    else end + 1)))
+        return history
 
     def copy_board(self):
         """ Return a deep copy of the current board,
@@ -176,7 +287,7 @@ class Board(object):
         """ Calculates pip count for a given player. Pip count is the total
             number of points a player has to move its checkers in order to
             bear all of them off. """
-        base = self.getHome(player)
+        base = self.get_home(player)
         result = 0
 
         for i in range(Board.NUM_POINTS):
@@ -185,10 +296,25 @@ class Board(object):
                 # to home end point
                 result += self.get_checkers(i) * abs(base - i)
 
-        # add number of moves needed to clear the bar
-        result += Board.NUM_POINTS * self.getBar(player)
+        # add number of moves needed to clear the bar,
+        # checkers enter behind the first point
+        result += (Board.NUM_POINTS + 1) * self.get_bar(player)
         return result
 
+    def is_race(self):
+        """ Returns whether there is no more contact, ie every checker of
+            white has passed every checker of black, so that no checker
+            can be hit or blocked anymore. """
+        if self.bar[Board.WHITE] > 0 or self.bar[Board.BLACK] > 0:
+            return False
+
+        # white moves up, black moves down the points
+        white_points = [i for i in range(Board.NUM_POINTS) if self.colors[i] == Board.WHITE]
+        black_points = [i for i in range(Board.NUM_POINTS) if self.colors[i] == Board.BLACK]
+        if not white_points or not black_points:
+            return True
+        return min(white_points) > max(black_points)
+
     def move_to_location(self, player, location):
         """ Moves a checker of given color to the given location. """
 
@@ -385,6 +511,166 @@ class Board(object):
         off = self.get_off(player)
         return str(off) + " " + str(sign)
         
+    @staticmethod
+    def mirror_location(location):
+        """ Returns the location a point is mapped to when the board
+            is mirrored, ie seen from the other color. """
+        return Board.NUM_POINTS - 1 - location
+
+    def mirror(self):
+        """ Returns a new board with the colors swapped and the points
+            mirrored: white's checkers become black's and vice versa.
+            Mirroring twice gives the original position. The move
+            history is not carried over. """
+        mirrored = Board(self)
+        mirrored.reset_move_history()
+        mirrored.board = list(reversed(self.board))
+        mirrored.colors = [(Board.get_opponent(color) if color != Board.NEITHER \
+                                else Board.NEITHER) for color in reversed(self.colors)]
+        mirrored.bar = list(reversed(self.bar))
+        mirrored.off = list(reversed(self.off))
+        return mirrored
+
+    def get_canonical(self, player):
+        """ Returns the side-to-move view of this board: the position as
+            seen by the given color, which always plays as white in it.
+            White's boards are returned as copies, black's mirrored. """
+        if player == Board.WHITE:
+            return Board(self)
+        else:
+            return self.mirror()
+
+    @staticmethod
+    def from_canonical(canonical_board, player):
+        """ Inverse of get_canonical(): turns the side-to-move view
+            of the given color back into absolute coordinates. """
+        return canonical_board.get_canonical(player)
+
+    @staticmethod
+    def point_location(player, index):
+        """ Translates the index of a point, counted from the given color's
+            home (0 = its 1-point), to a location on the board. """
+        return (Board.NUM_POINTS - 1 - index if player == Board.WHITE else index)
+
+    def get_position_id(self, player):
+        """ Returns the gnubg-style position ID of this board as a 10-byte
+            string, seen from the given color, ie the player on roll.
+            For the opponent first and then for the player on roll, the points
+            are visited from the own 1-point to the 24-point, followed by
+            the bar: each checker sets a 1-bit and every point ends with a
+            0-bit. Bits are packed little endian into the bytes. Borne-off
+            checkers are implicit. The key is stable between processes and
+            can be used as dict key or as file record. """
+        id_bytes = bytearray(Board.POSITION_ID_LENGTH)
+        bit = 0
+
+        for color in (Board.get_opponent(player), player):
+            for index in range(Board.NUM_POINTS + 1):
+                if index == Board.NUM_POINTS:
+                    num = self.bar[color]
+                else:
+                    num = self.get_checkers(Board.point_location(color, index), color)
+                # one bit per checker, the 0-bit is implicit in the zeroed array
+                for i in range(num):
+                    id_bytes[bit >> 3] |= 1 << (bit & 7)
+                    bit += 1
+                bit += 1
+
+        return bytes(id_bytes)
+
+    def get_position_key(self):
+        """ Returns a compact string, which identifies the position in
+            absolute coordinates. Much cheaper to compute than a position ID. """
+        return str(bytearray(self.board) + bytearray(color + 1 for color in self.colors) \
+                                                    + bytearray(self.bar + self.off))
+
+    def get_position_id_string(self, player):
+        """ Returns the position ID as 14 base64 characters, as printed
+            by gnubg. E.g. the initial board is '4HPwATDgc/ABMA'. """
+        return base64.b64encode(self.get_position_id(player))[:Board.POSITION_ID_STRING_LENGTH]
+
+    @classmethod
+    def from_position_id(cls, position_id, player):
+        """ Builds a new board from a 10-byte position ID,
+            where the given color is the player on roll. """
+        if len(position_id) != Board.POSITION_ID_LENGTH:
+            raise BackgammonException("Invalid position ID: \
+                                        ID must be 10 bytes long!")
+
+        id_bytes = bytearray(position_id)
+        board = cls()
+        board.board = [0] * Board.NUM_POINTS
+        board.colors = [Board.NEITHER] * Board.NUM_POINTS
+        board.bar = [0] * 2
+        board.off = [0] * 2
+
+        num_bits = Board.POSITION_ID_LENGTH * 8
+        bit = 0
+        for color in (Board.get_opponent(player), player):
+            total = 0
+            for index in range(Board.NUM_POINTS + 1):
+                num = 0
+                while bit < num_bits and id_bytes[bit >> 3] & (1 << (bit & 7)):
+                    num += 1
+                    bit += 1
+                # skip the 0-bit terminating the point
+                bit += 1
+                total += num
+                if total > Board.NUM_CHECKERS or bit > num_bits:
+                    raise BackgammonException("Invalid position ID: \
+                                        Too many checkers for a player!")
+                if num == 0:
+                    continue
+                if index == Board.NUM_POINTS:
+                    board.bar[color] = num
+                else:
+                    location = Board.point_location(color, index)
+                    if board.colors[location] != Board.NEITHER:
+                        raise BackgammonException("Invalid position ID: \
+                                        Point occupied by both players!")
+                    board.board[location] = num
+                    board.colors[location] = color
+            board.off[color] = Board.NUM_CHECKERS - total
+
+        return board
+
+    @classmethod
+    def from_position_id_string(cls, position_id_string, player):
+        """ Builds a new board from a 14-character base64 position ID. """
+        try:
+            position_id = base64.b64decode(position_id_string.strip() + '==')
+        except TypeError:
+            raise BackgammonException("Invalid position ID: \
+                                        Not a base64 string!")
+        return cls.from_position_id(position_id, player)
+
+    @staticmethod
+    def save_position_ids(filename, position_ids):
+        """ Writes position IDs as fixed-size 10-byte records to a file. """
+        with open(filename, 'wb') as fhandle:
+            for position_id in position_ids:
+                fhandle.write(position_id)
+
+    @staticmethod
+    def load_position_ids(filename):
+        """ Yields the 10-byte position IDs stored in a file,
+            which was written by save_position_ids(). """
+        with open(filename, 'rb') as fhandle:
+            while True:
+                record = fhandle.read(Board.POSITION_ID_LENGTH)
+                if not record:
+                    break
+                if len(record) != Board.POSITION_ID_LENGTH:
+                    raise BackgammonException("Truncated position ID file!")
+                yield record
+
+    @classmethod
+    def load_boards(cls, filename, player):
+        """ Bulk import: yields a board for every position ID in the file,
+            with the given color on roll. """
+        for position_id in cls.load_position_ids(filename):
+            yield cls.from_position_id(position_id, player)
+
     def __eq__(self, other):
         """ Compare this board with provided other board object. """
         if isinstance(other, Board): 
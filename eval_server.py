@@ -0,0 +1,274 @@
+import json
+import socket
+import threading
+import time
+import SocketServer
+import numpy as np
+from board import Board, Dice
+from move import BoardFactory
+from player import Player
+from neural_net import NeuralNetwork
+from bgexceptions import BackgammonException
+
+
+class BatchRequest(object):
+    """ Input vectors of one client request, waiting for their outputs. """
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.outputs = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """ Coalesces the input vectors of concurrent requests into batches. A
+        batch is evaluated with one forward pass as soon as it holds
+        max_batch_size vectors, or max_wait seconds after its first
+        request arrived. """
+
+    def __init__(self, neural_network, max_batch_size=256, max_wait=0.002):
+        self.neural_network = neural_network
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        # counters
+        self.num_batches = 0
+        self.num_vectors = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def evaluate(self, vectors):
+        """ Returns the network outputs for the vectors, blocks until the
+            batch they were put into has been evaluated. """
+        request = BatchRequest(vectors)
+        with self.condition:
+            self.pending.append(request)
+            self.condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.outputs
+
+    def run(self):
+        """ Loop of the batching thread. """
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                # wait for more requests, until the batch is full or timed out
+                deadline = time.time() + self.max_wait
+                while (sum(len(r.vectors) for r in self.pending) < self.max_batch_size \
+                                                        and time.time() < deadline):
+                    self.condition.wait(deadline - time.time())
+                batch = self.pending
+                self.pending = []
+
+            self.evaluate_batch(batch)
+
+    def evaluate_batch(self, batch):
+        """ Runs one forward pass for all requests of the batch. """
+        vectors = [vector for request in batch for vector in request.vectors]
+        try:
+            outputs = self.neural_network.get_network_outputs(np.array(vectors))
+        except Exception, e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+
+        self.num_batches += 1
+        self.num_vectors += len(vectors)
+        start = 0
+        for request in batch:
+            request.outputs = outputs[start:start + len(request.vectors)]
+            start += len(request.vectors)
+            request.done.set()
+
+
+class EvaluationHandler(SocketServer.StreamRequestHandler):
+    """ Serves one client connection. Requests and responses are single
+        lines of JSON, see EvaluationServer. """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            response = self.server.handle_request_line(line)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+class EvaluationServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """ Local TCP server, which loads a network once and answers requests
+        of other processes. Each request is one line of JSON:
+            {"op": "evaluate", "position_id": ID, "player": 0}
+                network output and utility of a board the player moved to
+            {"op": "move", "position_id": ID, "player": 0, "dice": [3, 1]}
+                best board for the player on roll with the dice
+            {"op": "stats"}
+                latency and throughput counters
+        Position IDs are the base64 strings of Board.get_position_id_string(),
+        seen from the given player. Network calls of concurrent requests are
+        coalesced by a MicroBatcher. """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, neural_network, max_concurrency=16, \
+                                    max_batch_size=256, max_wait=0.002):
+        SocketServer.TCPServer.__init__(self, address, EvaluationHandler)
+        self.neural_network = neural_network
+        self.players = dict((color, Player(color, neural_network, False)) \
+                                for color in (Board.WHITE, Board.BLACK))
+        self.batcher = MicroBatcher(neural_network, max_batch_size, max_wait)
+        # limits the number of requests processed at the same time
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        # counters
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.num_requests = 0
+        self.num_errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def serve_forever(self, poll_interval=0.5):
+        self.batcher.start()
+        try:
+            SocketServer.TCPServer.serve_forever(self, poll_interval)
+        finally:
+            self.batcher.stop()
+
+    def handle_request_line(self, line):
+        """ Returns the response to one request line. """
+        start = time.time()
+        with self.slots:
+            try:
+                request = json.loads(line)
+                op = request.get('op')
+                if op == 'evaluate':
+                    response = self.evaluate(request)
+                elif op == 'move':
+                    response = self.move(request)
+                elif op == 'stats':
+                    response = self.get_stats()
+                else:
+                    raise BackgammonException("Unknown operation: %s" %(op))
+                response['ok'] = True
+                error = False
+            except (BackgammonException, ValueError, KeyError, TypeError), e:
+                response = {'ok': False, 'error': str(e)}
+                error = True
+
+        latency = time.time() - start
+        with self.lock:
+            self.num_requests += 1
+            self.num_errors += error
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        return response
+
+    def get_player(self, request):
+        player = int(request['player'])
+        if player not in self.players:
+            raise BackgammonException("Invalid player: %s" %(player))
+        return self.players[player]
+
+    def evaluate(self, request):
+        player = self.get_player(request)
+        board = Board.from_position_id_string(str(request['position_id']), player.color)
+        output = self.batcher.evaluate([player.board_to_vector(board)])[0]
+        return {'output': output.tolist(), 'utility': player.compute_utility(output)}
+
+    def move(self, request):
+        player = self.get_player(request)
+        board = Board.from_position_id_string(str(request['position_id']), player.color)
+        die1, die2 = [int(die) for die in request['dice']]
+        if not (Dice.MIN_VALUE <= die1 <= Dice.MAX_VALUE and \
+                        Dice.MIN_VALUE <= die2 <= Dice.MAX_VALUE):
+            raise BackgammonException("Invalid dice: %s, %s" %(die1, die2))
+        dice = Dice()
+        dice.roll(die1, die2)
+
+        all_boards = BoardFactory.generate_all_boards(player.color, dice, board)
+        outputs = self.batcher.evaluate([player.board_to_vector(b) for b in all_boards])
+        utilities = [player.compute_utility(output) for output in outputs]
+        best = max(range(len(all_boards)), key=lambda i: utilities[i])
+        return {'position_id': all_boards[best].get_position_id_string(player.color), \
+                'utility': utilities[best], \
+                'num_candidates': len(all_boards)}
+
+    def get_stats(self):
+        with self.lock:
+            uptime = time.time() - self.start_time
+            num_requests = self.num_requests
+            return {'requests': num_requests, \
+                    'errors': self.num_errors, \
+                    'batches': self.batcher.num_batches, \
+                    'mean_batch_size': (self.batcher.num_vectors / \
+                                float(self.batcher.num_batches) \
+                                if self.batcher.num_batches > 0 else 0.0), \
+                    'mean_latency': (self.total_latency / num_requests \
+                                if num_requests > 0 else 0.0), \
+                    'max_latency': self.max_latency, \
+                    'requests_per_second': num_requests / uptime}
+
+
+class EvaluationClient(object):
+    """ Loopback client for the EvaluationServer. """
+
+    def __init__(self, host='localhost', port=8765, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.fhandle = self.sock.makefile('rb')
+
+    def request(self, **request):
+        """ Sends one request and returns the response as a dict. """
+        self.sock.sendall(json.dumps(request) + '\n')
+        response = json.loads(self.fhandle.readline())
+        if not response.pop('ok'):
+            raise BackgammonException(response['error'])
+        return response
+
+    def evaluate(self, position_id, player):
+        return self.request(op='evaluate', position_id=position_id, player=player)
+
+    def move(self, position_id, player, dice):
+        return self.request(op='move', position_id=position_id, player=player, \
+                                                                    dice=list(dice))
+
+    def stats(self):
+        return self.request(op='stats')
+
+    def close(self):
+        self.fhandle.close()
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    import sys
+    port = (int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+
+    server = EvaluationServer(('localhost', port), NeuralNetwork(restore_from_file=True))
+    print "Serving network evaluations on localhost:%s ..." %(port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,217 @@
+import math
+import sys
+from multiprocessing import Pool
+import numpy as np
+from board import Board, DiceStream
+from player import Player, RandomPlayer
+from neural_net import NeuralNetwork
+from backgammon import Backgammon
+from tournament import load_network
+from adjudication import Adjudicator
+
+
+class DuplicateResult(object):
+    """ Result of a duplicate match: one score per pair of games, which is
+        the fraction of the pair won by the network. """
+
+    def __init__(self, pair_scores):
+        self.pair_scores = np.array(pair_scores, dtype=float)
+        self.num_pairs = len(pair_scores)
+        self.num_games = 2 * self.num_pairs
+        self.win_rate = self.pair_scores.mean()
+
+        # paired estimate: the pairs are the independent samples
+        self.std_error = (self.pair_scores.std(ddof=1) / math.sqrt(self.num_pairs) \
+                                if self.num_pairs > 1 else float('nan'))
+        # the same games treated as independent single games
+        self.unpaired_std_error = math.sqrt(self.win_rate * (1 - self.win_rate) \
+                                            / self.num_games)
+
+    def variance_reduction(self):
+        """ Returns the fraction of the variance removed by pairing, ie the
+            fraction of games saved for the same confidence. """
+        if self.unpaired_std_error == 0:
+            return 0.0
+        return 1.0 - (self.std_error / self.unpaired_std_error) ** 2
+
+    def confidence_interval(self, z=1.96):
+        return (self.win_rate - z * self.std_error, self.win_rate + z * self.std_error)
+
+    def __repr__(self):
+        return "Duplicate Result, {} games, win rate {:.3f} +- {:.3f} " \
+               "(unpaired +- {:.3f})".format(self.num_games, self.win_rate, \
+                                    1.96 * self.std_error, 1.96 * self.unpaired_std_error)
+
+
+def play_game(players, seed, game_index, adjudicator=None):
+    """ Plays game game_index of seed between the players
+        and returns the color of the winner. """
+    bg = Backgammon(training_mode=False, restore_net=False, players=players, seed=seed, \
+                                                            adjudicator=adjudicator)
+    bg.reset(game_index=game_index)
+    return bg.run().color
+
+
+def duplicate_match(neural_network, num_pairs, seed=None, adjudicator=None):
+    """ Evaluates the network against RandomPlayer with duplicate dice:
+        both games of a pair are played with the same dice, first with
+        the network as white, then as black. Luck of the dice cancels
+        out within a pair, so the paired estimate has a lower variance
+        than the same number of independent games. """
+    if seed is None:
+        seed = DiceStream().seed
+
+    pair_scores = []
+    for game_index in range(num_pairs):
+        score = 0.0
+        for color in (Board.WHITE, Board.BLACK):
+            network_player = Player(color, neural_network, learning_mode=False)
+            random_player = RandomPlayer(Board.get_opponent(color))
+            if play_game([network_player, random_player], seed, game_index, \
+                                                            adjudicator) == color:
+                score += 0.5
+        pair_scores.append(score)
+
+    return DuplicateResult(pair_scores)
+
+
+class SequentialTest(object):
+    """ Sequential probability ratio tests on the win rate p of checkpoint a
+        against checkpoint b. One test decides between p = 0.5 and
+        p = 0.5 + margin, the other between p = 0.5 and p = 0.5 - margin,
+        both with error rates alpha and beta. a is better (worse) when the
+        first (second) test accepts its alternative and equal within the
+        margin when both accept p = 0.5. """
+
+    BETTER = 'better'
+    WORSE = 'worse'
+    EQUAL = 'equal'
+
+    def __init__(self, margin=0.05, alpha=0.05, beta=0.05):
+        self.margin = margin
+        # Wald's bounds of the log-likelihood ratio
+        self.lower_bound = math.log(beta / (1 - alpha))
+        self.upper_bound = math.log((1 - beta) / alpha)
+        # log-likelihood ratios of a won and a lost game for both tests
+        self.llr_steps = {}
+        for name, p1 in ((self.BETTER, 0.5 + margin), (self.WORSE, 0.5 - margin)):
+            self.llr_steps[name] = (math.log(p1 / 0.5), math.log((1 - p1) / 0.5))
+        self.llrs = {self.BETTER: 0.0, self.WORSE: 0.0}
+        # tests which accepted p = 0.5
+        self.accepted_null = set()
+        self.num_games = 0
+        self.wins = 0
+
+    def add_game(self, won):
+        """ Adds the result of one game of a and returns the decision,
+            or None if the test has to go on. """
+        self.num_games += 1
+        self.wins += won
+        for name, llr in self.llrs.items():
+            if name in self.accepted_null:
+                continue
+            llr += self.llr_steps[name][0 if won else 1]
+            self.llrs[name] = llr
+            if llr >= self.upper_bound:
+                return name
+            if llr <= self.lower_bound:
+                self.accepted_null.add(name)
+
+        if len(self.accepted_null) == len(self.llrs):
+            return self.EQUAL
+        return None
+
+
+class ConfidenceTest(object):
+    """ Confidence-bound stopping rule on the win rate of checkpoint a:
+        a is better (worse) once the confidence interval is above (below)
+        0.5, and equal once it lies within 0.5 +- margin. Checking after
+        every game inflates the error rate a little, which min_games and
+        a large z keep small. """
+
+    def __init__(self, margin=0.05, z=2.576, min_games=100):
+        self.margin = margin
+        self.z = z
+        self.min_games = min_games
+        self.num_games = 0
+        self.wins = 0
+
+    def add_game(self, won):
+        self.num_games += 1
+        self.wins += won
+        if self.num_games < self.min_games:
+            return None
+
+        win_rate = self.wins / float(self.num_games)
+        half_width = self.z * math.sqrt(win_rate * (1 - win_rate) / self.num_games)
+        if win_rate - half_width > 0.5:
+            return SequentialTest.BETTER
+        if win_rate + half_width < 0.5:
+            return SequentialTest.WORSE
+        if (win_rate - half_width >= 0.5 - self.margin and \
+                win_rate + half_width <= 0.5 + self.margin):
+            return SequentialTest.EQUAL
+        return None
+
+
+def play_checkpoint_game(args):
+    """ Worker function: plays game number game of checkpoint a against
+        checkpoint b and returns whether a won and the adjudication rule,
+        which ended the game, if any. Games 2i and 2i + 1 use the same dice
+        with swapped colors. """
+    path_a, path_b, seed, game, adjudicator = args
+    color_a = (Board.WHITE if game % 2 == 0 else Board.BLACK)
+    player_a = Player(color_a, load_network(path_a), learning_mode=False)
+    player_b = Player(Board.get_opponent(color_a), load_network(path_b), \
+                                                        learning_mode=False)
+    bg = Backgammon(training_mode=False, restore_net=False, players=[player_a, player_b], \
+                    seed=seed, adjudicator=adjudicator)
+    bg.reset(game_index=game // 2)
+    return int(bg.run().color == color_a), bg.game_record['adjudicated']
+
+
+def sequential_match(path_a, path_b, test=None, max_games=10000, processes=None, \
+                                        batch_size=64, seed=None, adjudicator=None):
+    """ Plays checkpoint a against checkpoint b until test reaches a decision
+        or max_games were played. Games are played in batches in a process
+        pool, but are added to the test in the order of their number, so the
+        decision does not depend on which games finish first. Returns the
+        decision (None if there was none), the number of games used and
+        the number of games won by a. The adjudicated games among them are
+        counted by adjudicator. """
+    if test is None:
+        test = SequentialTest()
+    if seed is None:
+        seed = DiceStream().seed
+
+    decision = None
+    pool = Pool(processes)
+    try:
+        for start in range(0, max_games, batch_size):
+            games = [(path_a, path_b, seed, game, adjudicator) \
+                        for game in range(start, min(start + batch_size, max_games))]
+            for won, rule in pool.imap(play_checkpoint_game, games):
+                if adjudicator is not None:
+                    adjudicator.count(rule)
+                decision = test.add_game(won)
+                if decision is not None:
+                    break
+            if decision is not None:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return decision, test.num_games, test.wins
+
+
+if __name__ == '__main__':
+    num_pairs = (int(sys.argv[1]) if len(sys.argv) > 1 else 100)
+    seed = (int(sys.argv[2]) if len(sys.argv) > 2 else None)
+
+    adjudicator = Adjudicator()
+    result = duplicate_match(NeuralNetwork(restore_from_file=True), num_pairs, seed, \
+                                                                        adjudicator)
+    print result
+    print adjudicator
+    print "Variance reduction by pairing: {:.1%}".format(result.variance_reduction())
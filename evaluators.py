@@ -0,0 +1,242 @@
+import math
+import numpy as np
+from board import Board, Dice
+
+
+class Evaluator(object):
+    """ Interface of the position evaluators. evaluate() returns the
+        estimated probability, that the player who just moved to the board
+        wins the game, while the opponent is on roll. """
+
+    def evaluate(self, board, player):
+        raise NotImplementedError
+
+    def evaluate_all(self, boards, player):
+        return [self.evaluate(board, player) for board in boards]
+
+
+class NeuralNetEvaluator(Evaluator):
+    """ The network of a Player, for positions with contact. """
+
+    def __init__(self, player):
+        self.player = player
+
+    def evaluate_all(self, boards, player):
+        outputs = self.player.evaluate_network_boards(boards)
+        return [self.player.compute_utility(output) for output in outputs]
+
+    def evaluate(self, board, player):
+        return self.player.compute_utility(self.player.evaluate_network_board(board))
+
+
+# mean and variance of the pips of one roll
+ROLL_MEAN = sum(probability * (4 if die1 == die2 else 2) * (die1 + die2) / 2.0 \
+                    for die1, die2, probability in Dice.distinct_rolls())
+ROLL_VARIANCE = sum(probability * ((4 if die1 == die2 else 2) * (die1 + die2) / 2.0) ** 2 \
+                    for die1, die2, probability in Dice.distinct_rolls()) - ROLL_MEAN ** 2
+
+
+class RaceEvaluator(Evaluator):
+    """ Pip count formula for races: the number of rolls each side needs
+        is approximately normal, with the mean and variance of the pips of
+        a roll, and the side on roll is half a roll ahead. """
+
+    @staticmethod
+    def rolls_needed(pips):
+        """ Returns mean and variance of the number of rolls for pips. """
+        return pips / ROLL_MEAN, pips * ROLL_VARIANCE / ROLL_MEAN ** 3
+
+    def evaluate(self, board, player):
+        opponent = Board.get_opponent(player)
+        mean, variance = self.rolls_needed(board.get_pipcount(player))
+        opponent_mean, opponent_variance = self.rolls_needed(board.get_pipcount(opponent))
+        # the opponent is on roll and wins ties
+        deviation = math.sqrt(max(variance + opponent_variance, 1e-9))
+        z = (mean - opponent_mean + 0.5) / deviation
+        opponent_wins = 0.5 * (1 + math.erf(z / math.sqrt(2)))
+        return 1.0 - opponent_wins
+
+
+# bear-off tables, by maximum number of checkers
+_bearoff_tables = {}
+
+
+class BearOffEvaluator(Evaluator):
+    """ Exact evaluation of bear-offs with up to max_checkers checkers per
+        side in the home boards. A one-sided table holds, for every such
+        position, the distribution of the number of rolls to bear off all
+        checkers, when each roll is played to minimize the expected number
+        of rolls. Two distributions give the winning chance of the side
+        on roll. """
+
+    # longest bear-off of the table, in rolls
+    MAX_ROLLS = 64
+
+    def __init__(self, max_checkers=6):
+        self.max_checkers = max_checkers
+        if max_checkers not in _bearoff_tables:
+            _bearoff_tables[max_checkers] = self.build_table(max_checkers)
+        self.table = _bearoff_tables[max_checkers]
+
+    @staticmethod
+    def get_position(board, player):
+        """ Returns the checkers of player on the points 1 to 6 of its home
+            board, or None if it has checkers outside or too many left. """
+        position = [0] * 6
+        for location in range(Board.NUM_POINTS):
+            num = board.get_checkers(location, player)
+            if num > 0:
+                if not Board.in_home_board(player, location):
+                    return None
+                position[abs(Board.get_home(player) - location) - 1] += num
+        if board.get_bar(player) > 0:
+            return None
+        return tuple(position)
+
+    def can_evaluate(self, board):
+        for color in (Board.WHITE, Board.BLACK):
+            position = self.get_position(board, color)
+            if position is None or sum(position) > self.max_checkers:
+                return False
+        return True
+
+    @staticmethod
+    def die_moves(position, die):
+        """ Returns the positions after playing die in a one-sided bear-off. """
+        highest = max([point for point in range(1, 7) if position[point - 1] > 0] or [0])
+        results = []
+        for point in range(1, 7):
+            if position[point - 1] == 0:
+                continue
+            if point > die:
+                new_position = list(position)
+                new_position[point - 1] -= 1
+                new_position[point - die - 1] += 1
+            elif point == die or point == highest:
+                new_position = list(position)
+                new_position[point - 1] -= 1
+            else:
+                continue
+            results.append(tuple(new_position))
+        return results
+
+    @classmethod
+    def roll_moves(cls, position, die1, die2):
+        """ Returns all positions after playing a roll, every die is
+            playable as long as there are checkers left. """
+        sequences = ([[die1] * 4] if die1 == die2 else [[die1, die2], [die2, die1]])
+        results = set()
+        for sequence in sequences:
+            positions = set([position])
+            for die in sequence:
+                positions = set(new_position for current in positions \
+                                for new_position in (cls.die_moves(current, die) \
+                                                        or [current]))
+            results |= positions
+        return results
+
+    @classmethod
+    def build_table(cls, max_checkers):
+        """ Returns position -> distribution of the number of rolls. """
+        positions = [()]
+        for point in range(6):
+            positions = [position + (num,) for position in positions \
+                            for num in range(max_checkers + 1)]
+        positions = [position for position in positions if sum(position) <= max_checkers]
+        # bear-offs only lead to positions with fewer pips
+        positions.sort(key=lambda position: sum((point + 1) * num \
+                                                for point, num in enumerate(position)))
+
+        table = {}
+        expected_rolls = {}
+        empty = positions[0]
+        table[empty] = np.zeros(cls.MAX_ROLLS)
+        table[empty][0] = 1.0
+        expected_rolls[empty] = 0.0
+        for position in positions[1:]:
+            distribution = np.zeros(cls.MAX_ROLLS)
+            for die1, die2, probability in Dice.distinct_rolls():
+                best = min(cls.roll_moves(position, die1, die2), \
+                                    key=lambda next_position: expected_rolls[next_position])
+                distribution[1:] += probability * table[best][:-1]
+            table[position] = distribution
+            expected_rolls[position] = np.dot(np.arange(cls.MAX_ROLLS), distribution)
+        return table
+
+    def evaluate(self, board, player):
+        opponent = Board.get_opponent(player)
+        rolls = self.table[self.get_position(board, player)]
+        opponent_rolls = self.table[self.get_position(board, opponent)]
+        # the opponent is on roll and wins, if it needs no more rolls
+        opponent_wins = np.dot(opponent_rolls, np.cumsum(rolls[::-1])[::-1])
+        return 1.0 - opponent_wins
+
+
+class PhaseDispatcher(object):
+    """ Sends every board to the cheapest adequate evaluator of its game
+        phase: finished games are won, bear-offs of up to max_checkers
+        checkers per side go to the BearOffEvaluator, other races to the
+        RaceEvaluator and positions with contact to the network of the
+        player. Counts the boards per phase. """
+
+    FINISHED = 'finished'
+    BEAROFF = 'bearoff'
+    RACE = 'race'
+    CONTACT = 'contact'
+
+    def __init__(self, player, race=True, bearoff=True, max_checkers=6):
+        self.player = player
+        self.evaluators = {self.CONTACT: NeuralNetEvaluator(player)}
+        if race:
+            self.evaluators[self.RACE] = RaceEvaluator()
+        if bearoff:
+            self.evaluators[self.BEAROFF] = BearOffEvaluator(max_checkers)
+        self.counters = dict((phase, 0) for phase in (self.FINISHED, self.BEAROFF, \
+                                                        self.RACE, self.CONTACT))
+
+    def classify(self, board):
+        """ Returns the phase of a board. """
+        if board.is_gameover():
+            return self.FINISHED
+        if not board.is_race():
+            return self.CONTACT
+        if self.BEAROFF in self.evaluators and \
+                self.evaluators[self.BEAROFF].can_evaluate(board):
+            return self.BEAROFF
+        if self.RACE in self.evaluators:
+            return self.RACE
+        return self.CONTACT
+
+    def get_output(self, board):
+        """ Single board version of get_outputs(). """
+        phase = self.classify(board)
+        if phase == self.CONTACT:
+            self.counters[phase] += 1
+            return self.player.evaluate_network_board(board)
+        return self.get_outputs([board])[0]
+
+    def get_outputs(self, boards):
+        """ Returns outputs for the boards like the network outputs, ie
+            [white wins, black wins] in the perspective of the player,
+            so that Player.compute_utility() applies to all of them. """
+        player = self.player
+        phases = [self.classify(board) for board in boards]
+        utilities = [None] * len(boards)
+        for phase, evaluator in self.evaluators.items():
+            indices = [i for i in range(len(boards)) if phases[i] == phase]
+            if indices:
+                values = evaluator.evaluate_all([boards[i] for i in indices], player.color)
+                for i, value in zip(indices, values):
+                    utilities[i] = value
+        for i, phase in enumerate(phases):
+            self.counters[phase] += 1
+            if phase == self.FINISHED:
+                utilities[i] = float(boards[i].get_winner() == player.color)
+
+        if player.get_perspective() == Board.WHITE:
+            return [np.array([utility, 1.0 - utility]) for utility in utilities]
+        return [np.array([1.0 - utility, utility]) for utility in utilities]
+
+    def __repr__(self):
+        return "Phase Dispatcher, " + ", ".join("{} {}".format(phase, count) \
+                                        for phase, count in sorted(self.counters.items()))
@@ -0,0 +1,278 @@
+import numpy as np
+from board import Board
+# the JIT backend is optional, without Numba the kernels are plain Python
+# functions and BoardFactory and Player keep using their own code
+try:
+    from numba import jit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def jit(*args, **kwargs):
+        def decorator(function):
+            return function
+        return decorator
+
+# whether BoardFactory and Player dispatch to the kernels, see enable_kernels()
+USE_KERNELS = False
+
+
+def enable_kernels():
+    """ Makes BoardFactory.generate_all_boards() and Player.board_to_vector()
+        use the kernels, when Numba is available. Returns whether they do.
+        Opt-in, as the compiled kernels are only checked against the Python
+        code by test_fast_moves.py where Numba is installed. """
+    global USE_KERNELS
+    USE_KERNELS = NUMBA_AVAILABLE
+    return USE_KERNELS
+
+
+def disable_kernels():
+    global USE_KERNELS
+    USE_KERNELS = False
+
+
+# layout of a position array: signed checkers per point, white positive and
+# black negative, then the bar and the borne off checkers of white and black
+BAR_INDEX = 24
+OFF_INDEX = 26
+POSITION_SIZE = 28
+# more than the successors a single die can have on one board
+MAX_SUCCESSORS = 32
+# dedupe hashes are kept below 2^52
+HASH_MASK = (1 << 52) - 1
+
+
+@jit(nopython=True, cache=True)
+def die_successors(position, player, die, out, out_steps):
+    """ Writes the boards reachable by moving one checker of player with
+        die into out, and the move step codes into out_steps, in the order
+        of BoardFactory.compute_boards(). Returns their number. """
+    sign = (1 if player == 0 else -1)
+    direction = sign
+    home = (24 if player == 0 else -1)
+    count = 0
+
+    if position[BAR_INDEX + player] > 0:
+        # enter from the bar into the home board of the opponent
+        end = (die - 1 if player == 0 else 24 - die)
+        if position[end] * sign >= -1:
+            out[count, :] = position
+            if position[end] * sign == -1:
+                out[count, end] = 0
+                out[count, BAR_INDEX + 1 - player] += 1
+            out[count, BAR_INDEX + player] -= 1
+            out[count, end] += sign
+            out_steps[count] = 24 * 26 + end
+            count += 1
+        return count
+
+    for start in range(24):
+        if position[start] * sign <= 0:
+            continue
+        end = start + die * direction
+        if end < 0 or end > 23 or position[end] * sign < -1:
+            continue
+        out[count, :] = position
+        if position[end] * sign == -1:
+            out[count, end] = 0
+            out[count, BAR_INDEX + 1 - player] += 1
+        out[count, start] -= sign
+        out[count, end] += sign
+        out_steps[count] = start * 26 + end
+        count += 1
+
+    # bear-off needs all checkers in the home board
+    for point in range(24):
+        if position[point] * sign > 0 and abs(home - point) > 6:
+            return count
+
+    for step in range(1, 7):
+        start = home - step * direction
+        if position[start] * sign <= 0:
+            continue
+        distance = abs(start - home)
+        if die < distance:
+            continue
+        if die > distance:
+            # only from the highest point
+            higher = False
+            for point in range(distance + 1, 7):
+                if position[home - point * direction] * sign > 0:
+                    higher = True
+            if higher:
+                continue
+        out[count, :] = position
+        out[count, start] -= sign
+        out[count, OFF_INDEX + player] += 1
+        out_steps[count] = start * 26 + 25
+        count += 1
+
+    return count
+
+
+@jit(nopython=True, cache=True)
+def position_hash(position, num_moves):
+    value = num_moves
+    for i in range(POSITION_SIZE):
+        value = (value * 31 + position[i] + 16) & HASH_MASK
+    return value
+
+
+@jit(nopython=True, cache=True)
+def find_or_add(seen, positions, moves, index, use_moves):
+    """ Looks the position at index up in seen, a dict from hash to index.
+        Returns the index of an equal earlier position, or adds it and
+        returns index. The number of moves counts for equality with use_moves. """
+    key = position_hash(positions[index], (moves[index] if use_moves else 0))
+    while key in seen:
+        other = seen[key]
+        if (not use_moves or moves[other] == moves[index]) and \
+                np.all(positions[other] == positions[index]):
+            return other
+        key = (key + 1) & HASH_MASK
+    seen[key] = index
+    return index
+
+
+@jit(nopython=True, cache=True)
+def roll_boards(position, player, dice_sequences):
+    """ Enumerates the boards of a roll like BoardFactory.generate_all_boards():
+        every row of dice_sequences is played die by die, a board which
+        cannot use a die is kept as it is. Returns the positions, the move
+        step codes and the number of moves of the boards, each position
+        once, in the order of their first occurrence. Like the Python code,
+        the caller keeps the ones with the most moves. """
+    num_steps = dice_sequences.shape[1]
+    result_positions = np.zeros((0, POSITION_SIZE), dtype=np.int8)
+    result_steps = np.zeros((0, 4), dtype=np.int16)
+    result_moves = np.zeros(0, dtype=np.int8)
+    successors = np.zeros((MAX_SUCCESSORS, POSITION_SIZE), dtype=np.int8)
+    successor_steps = np.zeros(MAX_SUCCESSORS, dtype=np.int16)
+
+    for sequence in range(dice_sequences.shape[0]):
+        positions = np.zeros((1, POSITION_SIZE), dtype=np.int8)
+        positions[0, :] = position
+        steps = np.zeros((1, 4), dtype=np.int16)
+        moves = np.zeros(1, dtype=np.int8)
+
+        for die_index in range(num_steps):
+            die = dice_sequences[sequence, die_index]
+            capacity = positions.shape[0] * MAX_SUCCESSORS
+            next_positions = np.zeros((capacity, POSITION_SIZE), dtype=np.int8)
+            next_steps = np.zeros((capacity, 4), dtype=np.int16)
+            next_moves = np.zeros(capacity, dtype=np.int8)
+            seen = dict()
+            seen[-1] = -1
+            count = 0
+            for board in range(positions.shape[0]):
+                num = die_successors(positions[board], player, die, successors, \
+                                        successor_steps)
+                if num == 0:
+                    next_positions[count, :] = positions[board]
+                    next_steps[count, :] = steps[board]
+                    next_moves[count] = moves[board]
+                    if find_or_add(seen, next_positions, next_moves, count, True) == count:
+                        count += 1
+                for successor in range(num):
+                    next_positions[count, :] = successors[successor]
+                    next_steps[count, :] = steps[board]
+                    next_steps[count, moves[board]] = successor_steps[successor]
+                    next_moves[count] = moves[board] + 1
+                    if find_or_add(seen, next_positions, next_moves, count, True) == count:
+                        count += 1
+            positions = next_positions[:count]
+            steps = next_steps[:count]
+            moves = next_moves[:count]
+
+        result_positions = np.concatenate((result_positions, positions))
+        result_steps = np.concatenate((result_steps, steps))
+        result_moves = np.concatenate((result_moves, moves))
+
+    # keep the first of equal positions
+    seen = dict()
+    seen[-1] = -1
+    keep = np.zeros(result_positions.shape[0], dtype=np.bool_)
+    for index in range(result_positions.shape[0]):
+        keep[index] = (find_or_add(seen, result_positions, result_moves, index, False) \
+                                                                        == index)
+    return result_positions[keep], result_steps[keep], result_moves[keep]
+
+
+@jit(nopython=True, cache=True)
+def encode_position(position, turn, vector):
+    """ Writes the 198 network inputs of Player.board_to_vector() into vector,
+        turn is the color whose turn indicator is set. """
+    vector[:] = 0.0
+    for point in range(24):
+        num = abs(position[point])
+        if num == 0:
+            continue
+        start = (point * 4 if position[point] > 0 else 98 + point * 4)
+        if num < 4:
+            for i in range(num):
+                vector[start + i] = 1.0
+        else:
+            for i in range(3):
+                vector[start + i] = 1.0
+            vector[start + 3] = (num - 3.0) / 2
+    vector[96] = position[BAR_INDEX] / 2.0
+    vector[194] = position[BAR_INDEX + 1] / 2.0
+    vector[97] = position[OFF_INDEX] / 15.0
+    vector[195] = position[OFF_INDEX + 1] / 15.0
+    if turn == 0:
+        vector[197] = 1.0
+    else:
+        vector[196] = 1.0
+
+
+def board_to_array(board):
+    """ Returns the position array of a Board. """
+    position = np.zeros(POSITION_SIZE, dtype=np.int8)
+    for point in range(Board.NUM_POINTS):
+        if board.colors[point] == Board.WHITE:
+            position[point] = board.board[point]
+        elif board.colors[point] == Board.BLACK:
+            position[point] = -board.board[point]
+    position[BAR_INDEX:BAR_INDEX + 2] = board.bar
+    position[OFF_INDEX:OFF_INDEX + 2] = board.off
+    return position
+
+
+def array_to_board(position, steps, num_moves):
+    """ Returns a Board for a position array and its move step codes. """
+    board = Board.__new__(Board)
+    board.board = [abs(int(num)) for num in position[:Board.NUM_POINTS]]
+    board.colors = [(Board.WHITE if num > 0 else Board.BLACK if num < 0 \
+                        else Board.NEITHER) for num in position[:Board.NUM_POINTS]]
+    board.bar = [int(num) for num in position[BAR_INDEX:BAR_INDEX + 2]]
+    board.off = [int(num) for num in position[OFF_INDEX:OFF_INDEX + 2]]
+    board.move_steps = None
+    board.num_moves = 0
+    for step in steps[:num_moves]:
+        board.add_move_step(*divmod(int(step), Board.STEP_BASE))
+    return board
+
+
+def generate_all_boards(player, dice, board):
+    """ Returns the distinct boards of a roll, computed by the kernels, in
+        the order of their first occurrence in BoardFactory.generate_all_boards().
+        BoardFactory.select_boards() turns them into its result. """
+    board.reset_move_history()
+    if dice.is_doubles():
+        dice_sequences = np.array([[dice.get_die1()] * 4], dtype=np.int64)
+    else:
+        high, low = max(dice.get_dice()), min(dice.get_dice())
+        dice_sequences = np.array([[high, low], [low, high]], dtype=np.int64)
+
+    positions, steps, moves = roll_boards(board_to_array(board), player, dice_sequences)
+    return [array_to_board(positions[i], steps[i], moves[i]) \
+                for i in range(positions.shape[0])]
+
+
+def board_to_vector(board, turn):
+    """ Same input vector as Player.board_to_vector() for a board
+        and the color whose turn indicator is set. """
+    vector = np.zeros(198)
+    encode_position(board_to_array(board), turn, vector)
+    return vector
@@ -1,6 +1,7 @@
 from board import Board, Dice
 from bgexceptions import BackgammonException, IllegalMoveException
-#from numba import jit
+# JIT-compiled move generation, used after fast_moves.enable_kernels()
+import fast_moves
 
 
 class BarMove(object):
@@ -53,7 +54,7 @@ class BarMove(object):
         self.board.move_to_location(self.player, self.end)
 
         # update move history of the board
-        self.board.update_move_history(self.__str__())
+        self.board.add_move_step(Board.BAR_LOCATION, self.end)
         
         return self.board
 
@@ -142,7 +143,7 @@ class BearOffMove(object):
         self.board.move_off(self.player)
         
         # update move history of the board
-        self.board.update_move_history(self.__str__())
+        self.board.add_move_step(self.start, Board.OFF_LOCATION)
 
         return self.board
 
@@ -220,7 +221,7 @@ class NormalMove(object):
         self.board.move_to_location(self.player, self.end)
         
         # update move history of the board
-        self.board.update_move_history(self.__str__())
+        self.board.add_move_step(self.start, self.end)
 
         return self.board
 
@@ -248,6 +249,9 @@ class BoardFactory(object):
         """ Function takes an initial backgammon situation (player, dice, board),
             and generates all possible moves and the resulting boards.
             Returns a list of all possible moves from all dice combinations. """
+        if fast_moves.USE_KERNELS:
+            return cls.select_boards(fast_moves.generate_all_boards(player, dice, board))
+
         board.reset_move_history()
         
         # check if dice are doubles:
@@ -283,6 +287,13 @@ class BoardFactory(object):
 
         # list comprehension for transforming list of board-lists into list of boards
         lst = [item for sublist in all_boards for item in sublist]
+        return cls.select_boards(lst)
+
+    @staticmethod
+    def select_boards(lst):
+        """ Removes duplicates from the boards of a roll and returns the
+            ones with the most moves. The order only depends on the order
+            the distinct boards first occur in lst. """
         # transform list to set to get rid of duplicate boards
         # boards entering a set get key depending on their hash value and
         # identical boards will have identical hashes and removed from the set
@@ -296,12 +307,146 @@ class BoardFactory(object):
         # this is due to the construction of compute_boards() which only takes
         # one die into account and disregards the other die
         # determine number of moves, that all boards must contain
-        max_moves = max([len(item.move_history) for item in board_list])
+        max_moves = max([item.num_moves for item in board_list])
         # only keep those boards in the list that have max amount of moves
-        board_list = [b for b in board_list if len(b.move_history) == max_moves]
+        board_list = [b for b in board_list if b.num_moves == max_moves]
         
         return board_list
 
+    @classmethod
+    def generate_canonical_boards(cls, player, dice, board):
+        """ Same as generate_all_boards(), but works on one orientation only:
+            moves are generated for white on the side-to-move view of board
+            and the resulting boards are returned in that view as well. Use
+            Board.from_canonical() to get back to absolute coordinates. """
+        return cls.generate_all_boards(Board.WHITE, dice, board.get_canonical(player))
+
+    @staticmethod
+    def get_dice_sequences(dice):
+        """ Returns the orders the dice can be played in. """
+        if dice.is_doubles():
+            return [[dice.get_die1()] * 4]
+        return [sorted(dice.get_dice(), reverse=True), sorted(dice.get_dice())]
+
+    @classmethod
+    def iter_boards(cls, player, dice, board):
+        """ Generator version of generate_all_boards(): yields the same
+            boards one by one, while only the boards on the path of a depth
+            first search are alive. Intermediate and final boards are
+            deduplicated with sets of compact position keys. Boards which use all
+            dice are yielded right away. When there is none, the moves of a
+            roll are blocked and a second search yields the boards with the
+            most moves. """
+        board.reset_move_history()
+        sequences = cls.get_dice_sequences(dice)
+        num_dice = len(sequences[0])
+
+        # position keys of the boards yielded so far
+        seen = set()
+        max_moves = 0
+        for final_board in cls.iter_final_boards(player, sequences, board):
+            max_moves = max(max_moves, final_board.num_moves)
+            if final_board.num_moves == num_dice:
+                key = final_board.get_position_key()
+                if key not in seen:
+                    seen.add(key)
+                    yield final_board
+
+        if max_moves < num_dice:
+            for final_board in cls.iter_final_boards(player, sequences, board):
+                if final_board.num_moves == max_moves:
+                    key = final_board.get_position_key()
+                    if key not in seen:
+                        seen.add(key)
+                        yield final_board
+
+    @classmethod
+    def iter_final_boards(cls, player, sequences, board):
+        """ Yields the boards after playing all dice of each sequence,
+            a board which cannot use a die is kept as it is. Boards reached
+            at the same die of a sequence twice are only expanded once. """
+        for index, sequence in enumerate(sequences):
+            # (die index, moves, position key) of the boards expanded so far
+            visited = set()
+            stack = [(board, 0)]
+            while stack:
+                brd, depth = stack.pop()
+                if depth == len(sequence):
+                    yield brd
+                    continue
+
+                new_boards = cls.compute_die_boards(player, sequence[depth], brd) or [brd]
+                for new_board in reversed(new_boards):
+                    key = (depth + 1, new_board.num_moves, new_board.get_position_key())
+                    if key not in visited:
+                        visited.add(key)
+                        stack.append((new_board, depth + 1))
+
+    @classmethod
+    def iter_board_chunks(cls, player, dice, board, chunk_size=64):
+        """ Yields the boards of iter_boards() in lists of up to chunk_size. """
+        chunk = []
+        for new_board in cls.iter_boards(player, dice, board):
+            chunk.append(new_board)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def compute_die_boards(player, die, brd):
+        """ Returns all boards, which result from moving one checker
+            of player on brd with die, an empty list if there are none. """
+        new_boards = []
+        # check if bar move must be made
+        if brd.get_bar(player) > 0:
+            try:
+                # make a bar move, and return the resulting board
+                destination = Board.get_home(Board.get_opponent(player)) + \
+                                        die * Board.get_direction(player)
+                bar_move = BarMove(player, die, brd, destination)
+                tmp_board = bar_move.make_move()
+            except IllegalMoveException:
+                tmp_board = None
+            # make sure a bar move was legal and a new board was generated
+            # if yes, append new_boards
+            if tmp_board is not None:
+                new_boards.append(tmp_board)
+        # try normal or bear-off moves:
+        else:   
+            # loop over whole board
+            for pos in range(Board.NUM_POINTS):
+                # pos occupied by player
+                if brd.get_checkers(pos, player) > 0:
+                    try:
+                        # try to make a normal move and return resulting board
+                        destination = pos + (die * Board.get_direction(player))
+                        normal_move = NormalMove(player, die, brd, pos, destination)
+                        tmp_board = normal_move.make_move()
+                    except IllegalMoveException, e:
+                        tmp_board = None
+                    # make sure normal move was legal and a new board was generated
+                    # if yes, append new_boards
+                    if tmp_board is not None:
+                        new_boards.append(tmp_board)
+            # loop over players homeboard, ie the target quadrant
+            # of a player (white: 23...18 or black: 0...5)
+            for pos in range(Board.get_home(player) - Board.get_direction(player),\
+                Board.get_home(player) - (7 * Board.get_direction(player)),\
+                 - Board.get_direction(player)):
+                    try:
+                        # try to bear off checkers and return resulting board
+                        bear_off_move = BearOffMove(player, die, brd, pos)
+                        tmp_board = bear_off_move.make_move()
+                    except IllegalMoveException, e:
+                        tmp_board = None
+                    # make sure bearoff move was legal and a new board was generated
+                    # if yes, append new_boards
+                    if tmp_board is not None:
+                        new_boards.append(tmp_board)
+        return new_boards
+
     @staticmethod
     def compute_boards(player, die, boards):
         """ Function takes a starting board and replaces it with all possible
@@ -310,53 +455,7 @@ class BoardFactory(object):
         # boards is a list containing starting boards
         # loop over the boards in boards list
         for i, brd in enumerate(boards):
-            new_boards = []
-            # check if bar move must be made
-            if brd.get_bar(player) > 0:
-                try:
-                    # make a bar move, and return the resulting board
-                    destination = Board.get_home(Board.get_opponent(player)) + \
-                                            die * Board.get_direction(player)
-                    bar_move = BarMove(player, die, brd, destination)
-                    tmp_board = bar_move.make_move()
-                except IllegalMoveException:
-                    tmp_board = None
-                # make sure a bar move was legal and a new board was generated
-                # if yes, append new_boards
-                if tmp_board is not None:
-                    new_boards.append(tmp_board)
-            # try normal or bear-off moves:
-            else:   
-                # loop over whole board
-                for pos in range(Board.NUM_POINTS):
-                    # pos occupied by player
-                    if brd.get_checkers(pos, player) > 0:
-                        try:
-                            # try to make a normal move and return resulting board
-                            destination = pos + (die * Board.get_direction(player))
-                            normal_move = NormalMove(player, die, brd, pos, destination)
-                            tmp_board = normal_move.make_move()
-                        except IllegalMoveException, e:
-                            tmp_board = None
-                        # make sure normal move was legal and a new board was generated
-                        # if yes, append new_boards
-                        if tmp_board is not None:
-                            new_boards.append(tmp_board)
-                # loop over players homeboard, ie the target quadrant
-                # of a player (white: 23...18 or black: 0...5)
-                for pos in range(Board.get_home(player) - Board.get_direction(player),\
-                    Board.get_home(player) - (7 * Board.get_direction(player)),\
-                     - Board.get_direction(player)):
-                        try:
-                            # try to bear off checkers and return resulting board
-                            bear_off_move = BearOffMove(player, die, brd, pos)
-                            tmp_board = bear_off_move.make_move()
-                        except IllegalMoveException, e:
-                            tmp_board = None
-                        # make sure bearoff move was legal and a new board was generated
-                        # if yes, append new_boards
-                        if tmp_board is not None:
-                            new_boards.append(tmp_board)
+            new_boards = BoardFactory.compute_die_boards(player, die, brd)
             
             # check if new boards were created
             # and if yes, replace each starting board in boards with
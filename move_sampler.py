@@ -0,0 +1,283 @@
+import math
+import random
+import sys
+import time
+from board import Board, Dice, DiceStream
+from move import BoardFactory, BarMove, BearOffMove, NormalMove
+from bgexceptions import IllegalMoveException
+
+
+class UniformMoveSampler(object):
+    """ Draws one of the boards of BoardFactory.generate_all_boards(), each
+        distinct board with the same probability, without enumerating them.
+
+        Before a roll, the locations a checker might move from with each
+        die are collected: the ones with checkers and the ones reached by
+        earlier dice, without those whose destination is a point the
+        opponent holds, as such a point stays blocked during the roll. A
+        proposal picks one of these locations per die at random, and is
+        rejected when the move is illegal. The order of the dice is picked
+        in proportion to its number of location choices, so every path
+        which plays all dice is proposed with the same probability. A board
+        reached by m paths is then accepted with probability 1/m, which
+        makes the boards uniform. The paths to a board are counted by a
+        search, which only follows moves that can still lead to it.
+
+        After MAX_REJECTIONS rejected proposals the boards are enumerated
+        instead. Every accepted proposal is uniform, so this keeps the
+        boards uniform and bounds the work for blocked rolls, including the
+        ones which cannot be played completely, where all proposals fail. """
+
+    # rejected proposals before falling back to the enumeration
+    MAX_REJECTIONS = 128
+
+    def __init__(self, random_generator=None):
+        self.random = (random_generator if random_generator is not None \
+                        else random.Random())
+        # counters
+        self.num_samples = 0
+        self.num_proposals = 0
+        self.num_fallbacks = 0
+
+    @staticmethod
+    def get_slots(player, board):
+        """ Returns the locations a checker of player may move from. """
+        if board.get_bar(player) > 0:
+            return [Board.BAR_LOCATION]
+        return [pos for pos in range(Board.NUM_POINTS) \
+                    if board.get_checkers(pos, player) > 0]
+
+    @staticmethod
+    def get_destination(player, die, start):
+        direction = Board.get_direction(player)
+        if start == Board.BAR_LOCATION:
+            return Board.get_home(Board.get_opponent(player)) + die * direction
+        return start + die * direction
+
+    @classmethod
+    def make_move(cls, player, die, board, start):
+        """ Returns the board after moving a checker of player from start
+            with die, None if the move is illegal. """
+        destination = cls.get_destination(player, die, start)
+        try:
+            if start == Board.BAR_LOCATION:
+                return BarMove(player, die, board, destination).make_move()
+            if Board.on_board(destination):
+                return NormalMove(player, die, board, start, destination).make_move()
+            return BearOffMove(player, die, board, start).make_move()
+        except IllegalMoveException:
+            return None
+
+    @classmethod
+    def get_candidates(cls, player, sequence, board):
+        """ Returns per die of sequence the locations a checker might move
+            from, in every way of playing the dice before it. """
+        opponent = Board.get_opponent(player)
+        num_bar = board.get_bar(player)
+        reached = set(pos for pos in range(Board.NUM_POINTS) \
+                        if board.get_checkers(pos, player) > 0)
+        # bearing off needs a move for each of these checkers first
+        num_outside = num_bar + sum(board.get_checkers(pos, player) for pos in reached \
+                                    if not Board.in_home_board(player, pos))
+        candidates = []
+        for index, die in enumerate(sequence):
+            # checkers on the bar enter first
+            starts = ([Board.BAR_LOCATION] if index < num_bar else sorted(reached))
+            starts = [start for start in starts \
+                        if (board.get_checkers(cls.get_destination(player, die, start), \
+                                                opponent) < 2 \
+                            if Board.on_board(cls.get_destination(player, die, start)) \
+                            else num_outside <= index)]
+            candidates.append(starts)
+            reached.update(cls.get_destination(player, die, start) for start in starts \
+                            if Board.on_board(cls.get_destination(player, die, start)))
+        return candidates
+
+    def propose(self, player, sequence, board, candidates):
+        """ Plays the dice of sequence from random candidate locations,
+            returns the final board or None, if a move was illegal. """
+        for die, starts in zip(sequence, candidates):
+            board = self.make_move(player, die, board, self.random.choice(starts))
+            if board is None:
+                return None
+        return board
+
+    def sample(self, player, dice, board):
+        """ Returns a uniformly random board of the roll. """
+        board.reset_move_history()
+        sequences = BoardFactory.get_dice_sequences(dice)
+        candidates = [self.get_candidates(player, sequence, board) for sequence in sequences]
+        # number of location choices of each order
+        weights = [reduce(lambda product, starts: product * len(starts), \
+                            sequence_candidates, 1) for sequence_candidates in candidates]
+
+        rejections = 0
+        while sum(weights) > 0 and rejections < self.MAX_REJECTIONS:
+            self.num_proposals += 1
+            index = (0 if self.random.random() * sum(weights) < weights[0] else 1)
+            final_board = self.propose(player, sequences[index], board, candidates[index])
+            if final_board is not None:
+                num_paths = self.count_paths(player, sequences, board, final_board)
+                if self.random.random() * num_paths < 1.0:
+                    self.num_samples += 1
+                    return final_board
+
+            rejections += 1
+
+        self.num_fallbacks += 1
+        return self.random.choice(BoardFactory.generate_all_boards(player, dice, board))
+
+    @staticmethod
+    def get_locations(player):
+        """ Returns the locations of player in the order checkers pass them. """
+        points = range(Board.NUM_POINTS)
+        if Board.get_direction(player) < 0:
+            points.reverse()
+        return [Board.BAR_LOCATION] + points + [Board.OFF_LOCATION]
+
+    @staticmethod
+    def get_progress(player, board, locations):
+        """ Returns the number of checkers of player up to each location. """
+        progress = []
+        total = 0
+        for location in locations:
+            if location == Board.BAR_LOCATION:
+                total += board.get_bar(player)
+            elif location == Board.OFF_LOCATION:
+                total += board.get_off(player)
+            else:
+                total += board.get_checkers(location, player)
+            progress.append(total)
+        return progress
+
+    def count_paths(self, player, sequences, board, target):
+        """ Returns the number of ways to play all dice from board to target.
+            Checkers only move forward, so a board can only lead to the
+            target while it has more checkers up to every location, which a
+            moving checker passes, than the target. """
+        locations = self.get_locations(player)
+        indices = dict((location, index) for index, location in enumerate(locations))
+        target_progress = self.get_progress(player, target, locations)
+        target_key = target.get_position_key()
+
+        def count(sequence, depth, brd, memo):
+            if depth == len(sequence):
+                return int(brd.get_position_key() == target_key)
+            key = (depth, brd.get_position_key())
+            if key not in memo:
+                progress = self.get_progress(player, brd, locations)
+                die = sequence[depth]
+                total = 0
+                for start in self.get_slots(player, brd):
+                    first = indices[start]
+                    if any(progress[i] <= target_progress[i] for i in \
+                            range(first, min(first + die, len(locations) - 1))):
+                        continue
+                    new_board = self.make_move(player, die, brd, start)
+                    if new_board is not None:
+                        total += count(sequence, depth + 1, new_board, memo)
+                memo[key] = total
+            return memo[key]
+
+        return sum(count(sequence, 0, board, {}) for sequence in sequences)
+
+    def __repr__(self):
+        num_moves = self.num_samples + self.num_fallbacks
+        return "Uniform Move Sampler, {} moves, {:.2f} proposals per move, " \
+               "{} enumerated".format(num_moves, self.num_proposals / float(max(num_moves, 1)), \
+                                      self.num_fallbacks)
+
+
+def sample_positions(num_positions=50, seed=0):
+    """ Returns (player, dice, board) of positions from random games,
+        the dice of every position are rolled independently. """
+    stream = DiceStream(DiceStream.derive_seed(seed, 'sampler positions'))
+    choices = random.Random(seed)
+    positions = []
+    while len(positions) < num_positions:
+        board = Board()
+        player = Board.WHITE
+        while not board.is_gameover() and len(positions) < num_positions:
+            dice = Dice(stream)
+            dice.roll()
+            positions.append((player, dice, Board(board)))
+            board = choices.choice(BoardFactory.generate_all_boards(player, dice, board))
+            player = Board.get_opponent(player)
+    return positions
+
+
+def chi_square_p_value(statistic, degrees):
+    """ Upper tail of the chi-square distribution, by the Wilson-Hilferty
+        normal approximation. """
+    if degrees <= 0:
+        return 1.0
+    scale = 2.0 / (9 * degrees)
+    z = ((statistic / degrees) ** (1.0 / 3) - (1 - scale)) / math.sqrt(scale)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def uniformity_check(num_positions=50, samples_per_board=40, seed=0, verbose=True):
+    """ Statistical check of the sampler against enumeration: for random
+        positions with at least two boards, draws samples_per_board times
+        the number of boards and runs a chi-square test of the counts
+        against the uniform distribution. Samples outside of the enumerated
+        boards are errors. Returns the pooled statistic, its degrees of
+        freedom, the p-value and the number of errors. """
+    sampler = UniformMoveSampler(random.Random(seed))
+    total_statistic = 0.0
+    total_degrees = 0
+    num_errors = 0
+    for player, dice, board in sample_positions(num_positions, seed):
+        all_boards = BoardFactory.generate_all_boards(player, dice, board)
+        if len(all_boards) < 2:
+            continue
+        counts = dict((brd.get_position_key(), 0) for brd in all_boards)
+        num_samples = samples_per_board * len(all_boards)
+        for i in range(num_samples):
+            key = sampler.sample(player, dice, board).get_position_key()
+            if key in counts:
+                counts[key] += 1
+            else:
+                num_errors += 1
+
+        statistic = sum((count - samples_per_board) ** 2 / float(samples_per_board) \
+                            for count in counts.values())
+        degrees = len(counts) - 1
+        total_statistic += statistic
+        total_degrees += degrees
+        if verbose:
+            print "%-6s %3s boards  chi2 %8.2f  p %.3f" %(dice, len(all_boards), \
+                                    statistic, chi_square_p_value(statistic, degrees))
+
+    p_value = chi_square_p_value(total_statistic, total_degrees)
+    if verbose:
+        print "pooled chi2 %.1f, %s degrees of freedom, p %.3f, %s errors" \
+                            %(total_statistic, total_degrees, p_value, num_errors)
+        print sampler
+    return total_statistic, total_degrees, p_value, num_errors
+
+
+def compare_speed(num_positions=500, seed=0):
+    """ Prints the seconds per move of the sampler and of random.choice()
+        over the enumerated boards. """
+    positions = sample_positions(num_positions, seed)
+    choices = random.Random(seed)
+    start = time.time()
+    for player, dice, board in positions:
+        choices.choice(BoardFactory.generate_all_boards(player, dice, board))
+    enumeration = time.time() - start
+
+    sampler = UniformMoveSampler(random.Random(seed))
+    start = time.time()
+    for player, dice, board in positions:
+        sampler.sample(player, dice, board)
+    sampling = time.time() - start
+    print "enumeration %.2f ms, sampler %.2f ms per move" \
+                %(1000 * enumeration / num_positions, 1000 * sampling / num_positions)
+    print sampler
+
+
+if __name__ == '__main__':
+    num_positions = (int(sys.argv[1]) if len(sys.argv) > 1 else 50)
+    uniformity_check(num_positions)
+    compare_speed()
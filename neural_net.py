@@ -1,6 +1,9 @@
 import numpy as np
+import hashlib
 import random
 import sys
+import threading
+from collections import OrderedDict
 # we need to save the network between serial trainings: we use pickle for that
 # pickling transforms an object into a bytestream of ASCII signs, which can be
 # written to a file
@@ -125,6 +128,369 @@ class OutputLayer(BaseLayer):
         return "Output Layer, size {}. Weights: {}".format(self.size, self.weights.shape)
 
 
+class EvaluationCache(object):
+    """ LRU cache for network outputs. Entries belong to a weights version
+        of the network and are dropped as soon as the weights change. """
+
+    # default number of cached network outputs
+    DEFAULT_CAPACITY = 100000
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        # weights version the cached entries were computed with
+        self.weights_version = None
+        # counters for the hit rate
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(self, key, weights_version):
+        """ Returns the cached output for key, or None if there is none
+            for the provided weights version. """
+        if weights_version != self.weights_version:
+            self.invalidate(weights_version)
+
+        output = self.entries.pop(key, None)
+        if output is None:
+            self.misses += 1
+        else:
+            # re-insert to mark the entry as the most recently used
+            self.entries[key] = output
+            self.hits += 1
+        return output
+
+    def store(self, key, output, weights_version):
+        """ Caches the output for key, evicts the least recently used
+            entry when the cache is full. """
+        if weights_version != self.weights_version:
+            self.invalidate(weights_version)
+
+        self.entries[key] = output
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, weights_version=None):
+        """ Drops all entries, eg because the weights changed. """
+        if self.entries:
+            self.invalidations += 1
+        self.entries.clear()
+        self.weights_version = weights_version
+
+    def hit_rate(self):
+        """ Returns the fraction of lookups answered from the cache. """
+        lookups = self.hits + self.misses
+        return (self.hits / float(lookups) if lookups > 0 else 0.0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "Evaluation Cache, {} entries, hit rate {:.3f}".format(len(self), \
+                                                            self.hit_rate())
+
+
+class ForwardBuffers(object):
+    """ Preallocated activations of one forward pass, with the bias
+        units built in at index 0 of the input and hidden buffers. Each
+        thread has its own, so that concurrent get_network_output() calls
+        are safe, eg in eval_server. Only inference is thread-safe: the
+        layers refer to the buffers of the thread which ran the last
+        forward pass, and back_prop() and get_training_output() use these
+        shared references and update the weights and traces. Training
+        must run in one thread. """
+
+    def __init__(self, input_size, hidden_size, output_size, bias_units):
+        self.offset = (1 if bias_units else 0)
+        self.input = np.ones(input_size + self.offset)
+        self.hidden = np.ones(hidden_size + self.offset)
+        self.output = np.zeros(output_size)
+
+    @staticmethod
+    def sigmoid(values):
+        """ Squashes values through the sigmoid in place. """
+        np.negative(values, out=values)
+        np.exp(values, out=values)
+        values += 1.0
+        np.reciprocal(values, out=values)
+
+
+class SparseTraces(object):
+    """ Eligibility traces of the hidden weights for sparse inputs. The
+        decay of all traces is kept in one global scale, so that a TD step
+        touches only the trace columns of the nonzero inputs. The weight
+        updates of a column are applied lazily: the errors times the scale
+        are summed up over all steps and a column adds its share of the sum
+        when it is flushed, ie before its traces change or its weights are
+        read. Gives the same weights as the dense update in back_prop(). """
+
+    # the traces are rescaled, once the scale drops below MIN_SCALE. The
+    # latest terms of the sums are about scale times smaller than the
+    # first ones, so they lose precision long before the scale underflows
+    MIN_SCALE = 1e-4
+
+    def __init__(self, layer, input_size, output_size, decay, learning_rate):
+        # hidden layer, whose weights are updated
+        self.layer = layer
+        self.input_size = input_size
+        self.decay = decay
+        self.learning_rate = learning_rate
+        # the actual traces are scale * traces
+        self.traces = np.zeros((layer.size, input_size, output_size))
+        self.scale = 1.0
+        # sum of error * scale over all steps, and its value
+        # at the last flush of each column
+        self.sums = np.zeros(output_size)
+        self.snapshots = np.zeros((input_size, output_size))
+        # counter
+        self.num_rescales = 0
+
+    def flush(self, columns=None):
+        """ Applies the pending weight updates of the given
+            weight columns, of all columns by default. """
+        if columns is None:
+            columns = np.arange(self.input_size)
+        pending = self.sums - self.snapshots[columns]
+        self.layer.weights[:, columns] += self.learning_rate * \
+                    np.einsum('hco,co->hc', self.traces[:, columns, :], pending)
+        self.snapshots[columns] = self.sums
+
+    def update(self, columns, values, deltas, error):
+        """ One TD step: decays all traces, adds deltas * values to the
+            traces of the active columns and updates the weights with
+            error. deltas has a row per hidden and a column per output unit. """
+        self.flush(columns)
+        self.scale *= self.decay
+        self.traces[:, columns, :] += deltas[:, None, :] * values[None, :, None] / self.scale
+        self.sums += error * self.scale
+
+        if self.scale < self.MIN_SCALE:
+            self.num_rescales += 1
+            self.flush()
+            self.traces *= self.scale
+            self.scale = 1.0
+            self.sums[:] = 0.0
+            self.snapshots[:] = 0.0
+
+    def reset(self):
+        """ Applies all pending weight updates and clears the traces. """
+        self.flush()
+        self.traces[:] = 0.0
+        self.scale = 1.0
+        self.sums[:] = 0.0
+        self.snapshots[:] = 0.0
+
+
+class BatchUpdate(object):
+    """ Mini-batch TD(lambda): the weights stay fixed for batch_size steps,
+        the updates of the steps are summed up and applied at once. The
+        hidden trace increments of a segment of steps are kept as they
+        are, at the end of a batch or game the sum of the weight updates
+        and the new traces follow from them with one matrix product. """
+
+    def __init__(self, network, batch_size, alpha, beta):
+        self.network = network
+        self.batch_size = batch_size
+        self.alpha = alpha
+        self.beta = beta
+        hidden_size, input_size = network.hidden_size, network.input_size
+        # summed weight updates of the batch, in the index ranges of back_prop()
+        self.hidden_update = np.zeros((hidden_size, input_size))
+        self.output_update = np.zeros((network.output_size, hidden_size))
+        self.num_steps = 0
+        # trace increments of the steps since the traces were last updated,
+        # the increment of a step is deltas[h, o] * inputs[i]
+        self.deltas = []
+        self.inputs = []
+        self.errors = []
+
+    def add_step(self, deltas, inputs, error, output_traces):
+        """ Adds one step, applies the batch once it is complete.
+            The small output traces are updated right away. """
+        self.output_update += self.beta * error[:, None] * output_traces
+        self.deltas.append(deltas)
+        self.inputs.append(inputs)
+        self.errors.append(error)
+        self.num_steps += 1
+        if self.num_steps >= self.batch_size:
+            self.apply()
+
+    def close_segment(self):
+        """ Adds the weight updates of the recorded steps to the batch and
+            brings the hidden traces up to date. Needed before the traces
+            are reset. """
+        num = len(self.errors)
+        if num == 0:
+            return
+        decay = self.network.LAMBDA
+        traces = self.network.layer_dict['hidden'].e_traces
+        deltas = np.array(self.deltas)
+        inputs = np.array(self.inputs)
+        errors = np.array(self.errors)
+
+        # the trace of step t is decay^(t + 1) * traces
+        #   + sum(decay^(t - s) * deltas[s] * inputs[s] for s <= t),
+        # so the increment of step s is weighted by the decayed sum of the
+        # errors from step s on
+        weighted_errors = np.zeros_like(errors)
+        running = np.zeros(errors.shape[1])
+        for step in reversed(range(num)):
+            running = errors[step] + decay * running
+            weighted_errors[step] = running
+        initial_weights = decay * weighted_errors[0]
+
+        self.hidden_update += self.alpha * (np.dot(traces, initial_weights) + \
+                np.dot(np.einsum('sho,so->hs', deltas, weighted_errors), inputs))
+
+        decays = decay ** np.arange(num - 1, -1, -1)
+        traces *= decay ** num
+        for o in range(traces.shape[2]):
+            traces[:, :, o] += np.dot((deltas[:, :, o] * decays[:, None]).T, inputs)
+
+        self.deltas = []
+        self.inputs = []
+        self.errors = []
+
+    def apply(self):
+        """ Applies the summed weight updates of the batch. """
+        self.close_segment()
+        if self.num_steps == 0:
+            return
+        network = self.network
+        network.layer_dict['hidden'].weights[:, :network.input_size] += self.hidden_update
+        network.layer_dict['output'].weights[:, :network.hidden_size] += self.output_update
+        self.hidden_update[:] = 0.0
+        self.output_update[:] = 0.0
+        self.num_steps = 0
+        # cached outputs of the old weights are stale now
+        network.weights_version += 1
+
+
+class IncrementalEvaluator(object):
+    """ Evaluates positions close to a base position. The hidden layer
+        pre-activations of the base are kept, those of another input are
+        derived by adding the weight columns of the input units which
+        differ from the base, times the difference. A move changes only a
+        few units, so a few column updates replace the product with the
+        full hidden weight matrix. The layer activations used by
+        back_prop() are left untouched. """
+
+    def __init__(self, neural_network):
+        self.neural_network = neural_network
+        self.base_input = None
+        self.base_preactivations = None
+        # weights version the base pre-activations were computed with
+        self.weights_version = None
+        # counters
+        self.num_evaluations = 0
+        self.num_column_updates = 0
+
+    def set_base(self, input_values):
+        """ Computes and keeps the hidden pre-activations of input_values. """
+        network = self.neural_network
+        self.base_input = np.array(input_values, dtype=float)
+        network.flush_weights(self.base_input)
+        hidden_weights = network.layer_dict['hidden'].weights
+        self.base_preactivations = np.dot(hidden_weights[:, -network.input_size:], \
+                                                                self.base_input)
+        if network.BIAS_UNITS:
+            self.base_preactivations += hidden_weights[:, 0]
+        self.weights_version = network.weights_version
+
+    def evaluate(self, input_values):
+        """ Returns the network output for input_values. Uses input_values
+            as the new base, when there is none yet or the weights changed
+            since it was set. """
+        network = self.neural_network
+        if self.base_input is None or self.weights_version != network.weights_version:
+            self.set_base(input_values)
+
+        hidden_layer = network.layer_dict['hidden']
+        output_layer = network.layer_dict['output']
+        offset = (1 if network.BIAS_UNITS else 0)
+
+        delta = np.asarray(input_values, dtype=float) - self.base_input
+        changed = np.flatnonzero(delta)
+        network.flush_weights(delta)
+        preactivations = self.base_preactivations + \
+                np.dot(hidden_layer.weights[:, changed + offset], delta[changed])
+        hidden_out = hidden_layer.sigmoid(preactivations)
+
+        output_weights = output_layer.weights
+        output_in = np.dot(output_weights[:, offset:], hidden_out)
+        if network.BIAS_UNITS:
+            output_in += output_weights[:, 0]
+
+        self.num_evaluations += 1
+        self.num_column_updates += len(changed)
+        return output_layer.sigmoid(output_in)
+
+    def __repr__(self):
+        return "Incremental Evaluator, {} evaluations, {:.1f} columns each".format( \
+                    self.num_evaluations, (self.num_column_updates / \
+                    float(self.num_evaluations) if self.num_evaluations > 0 else 0.0))
+
+
+class ActivationCache(object):
+    """ Layer activations of the positions evaluated in the current and
+        the previous ply, keyed by the bytes of the input vector, so that
+        back_prop() can run from them without another forward pass.
+        Entries belong to a weights version of the network, so they only
+        hit while the weights are unchanged, eg for a player who could not
+        move, or when the weights are updated in batches. """
+
+    def __init__(self, bias_units=True):
+        # the input activations start with the bias unit
+        self.offset = (1 if bias_units else 0)
+        self.current = {}
+        self.previous = {}
+        # weights version the entries were computed with
+        self.weights_version = None
+        # counters for the hit rate
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(input_values):
+        return np.asarray(input_values, dtype=float).tobytes()
+
+    def next_ply(self):
+        """ Starts a new ply, entries older than the previous ply are dropped. """
+        self.previous = self.current
+        self.current = {}
+
+    def check_version(self, weights_version):
+        if weights_version != self.weights_version:
+            self.current = {}
+            self.previous = {}
+            self.weights_version = weights_version
+
+    def store(self, activations, weights_version):
+        """ Stores the (input, hidden, output) activations, the key is
+            taken from the input activations. """
+        self.check_version(weights_version)
+        self.current[self.make_key(activations[0][self.offset:])] = activations
+
+    def lookup(self, key, weights_version):
+        self.check_version(weights_version)
+        activations = self.current.get(key)
+        if activations is None:
+            activations = self.previous.get(key)
+        if activations is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return activations
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return (self.hits / float(lookups) if lookups > 0 else 0.0)
+
+    def __repr__(self):
+        return "Activation Cache, {} lookups, hit rate {:.3f}".format( \
+                                        self.hits + self.misses, self.hit_rate())
+
+
 class NeuralNetwork(object):
     """ Wraps the single layers and constructs a neural network. """
     # learning rate alpha
@@ -140,7 +506,23 @@ class NeuralNetwork(object):
     SAVE_FILE = 'neural_net.pkl'
     
     def __init__(self, input_size=None, hidden_size=None, output_size=None, \
-                                                    restore_from_file=False):
+                                                    restore_from_file=False, save_file=None):
+        # file the network is saved to and restored from
+        self.save_file = (save_file if save_file is not None else self.SAVE_FILE)
+        # incremented by every weight update, used to invalidate cached outputs
+        self.weights_version = 0
+        # optional LRU cache for network outputs, see enable_cache()
+        self.evaluation_cache = None
+        # hidden traces of the sparse training path, see enable_sparse_traces()
+        self.sparse_traces = None
+        # pending updates of mini-batch training, see enable_batch_updates()
+        self.batch_update = None
+        # ForwardBuffers of get_network_output(), one per thread
+        self.thread_data = threading.local()
+        # optional activations of recent positions for back_prop(),
+        # see enable_activation_cache()
+        self.activation_cache = None
+
         if not restore_from_file:
             # initialize size and number of layers
             self.input_size = input_size
@@ -208,15 +590,29 @@ class NeuralNetwork(object):
         # initialize eligibility traces
         self.reset_all_traces()
     
+    def get_weights_fingerprint(self):
+        """ Returns a hex digest of all weights. Unlike weights_version it
+            is stable between processes, eg to check saved data against. """
+        self.flush_weights()
+        digest = hashlib.sha1()
+        for key in ('hidden', 'output'):
+            digest.update(np.ascontiguousarray(self.layer_dict[key].weights).tobytes())
+        return digest.hexdigest()
+
     def update_counter(self):
         self.num_games += 1
 
     def reset_all_traces(self):
         """ Resets the eligibility trace arrays of all layers to np.zeros-arrays. """
+        # the recorded steps of a batch need the traces of their game
+        if self.batch_update is not None:
+            self.batch_update.close_segment()
         # dont set e_traces for input layer, it has none
         for key, layer in self.layer_dict.items():            
             if key != 'input':
                 layer.reset_e_traces()
+        if self.sparse_traces is not None:
+            self.sparse_traces.reset()
 
     def connect_layers(self, layer1, layer2, weights):
         """ Connects the layers of the network, sets weights to random values. """
@@ -251,13 +647,141 @@ class NeuralNetwork(object):
         else:
             print self.layer_dict[layer_name].__dict__
 
+    def get_buffers(self):
+        """ Returns the ForwardBuffers of the calling thread. """
+        buffers = getattr(self.thread_data, 'buffers', None)
+        if buffers is None:
+            buffers = ForwardBuffers(self.input_size, self.hidden_size, \
+                                        self.output_size, self.BIAS_UNITS)
+            self.thread_data.buffers = buffers
+        return buffers
+
     def get_network_output(self, input_values):
-        """ Computes the output of the network
-            given the provided input. """
+        """ Computes the output of the network given the provided input.
+            Fused version of the forward pass of the layers, which computes
+            in the buffers of the calling thread, without allocating
+            anything but the returned copy of the output. The layers refer
+            to the buffers, for back_prop() to read the activations.
+            Thread-safe as long as no thread trains, see ForwardBuffers. """
+        self.flush_weights(input_values)
+        buffers = self.get_buffers()
+        offset = buffers.offset
         # feed the network with input
-        self.layer_dict['input'].get_input(input_values)
+        buffers.input[offset:] = input_values
+
+        hidden_layer = self.layer_dict['hidden']
+        np.dot(hidden_layer.weights, buffers.input, out=buffers.hidden[offset:])
+        buffers.sigmoid(buffers.hidden[offset:])
+
+        output_layer = self.layer_dict['output']
+        np.dot(output_layer.weights, buffers.hidden, out=buffers.output)
+        buffers.sigmoid(buffers.output)
+
+        self.layer_dict['input'].output_values = buffers.input
+        hidden_layer.output_values = buffers.hidden
+        output_layer.output_values = buffers.output
         # return the computed output
-        return self.layer_dict['output'].compute_output()
+        return buffers.output.copy()
+
+    def get_activations(self):
+        """ Returns copies of the (input, hidden, output) activations
+            of the last forward pass. """
+        return tuple(self.layer_dict[key].output_values.copy() \
+                        for key in ('input', 'hidden', 'output'))
+
+    def get_training_output(self, input_values):
+        """ Like get_network_output(), but takes the activations, which
+            back_prop() reads, from the activation cache if possible. """
+        cache = self.activation_cache
+        if cache is not None:
+            activations = cache.lookup(cache.make_key(input_values), self.weights_version)
+            if activations is not None:
+                for key, values in zip(('input', 'hidden', 'output'), activations):
+                    self.layer_dict[key].output_values = values
+                return activations[2].copy()
+        return self.get_network_output(input_values)
+
+    def get_network_outputs(self, input_matrix):
+        """ Batched forward pass: computes the outputs for all rows of
+            input_matrix with one matrix product per layer. Unlike
+            get_network_output() the cached layer activations, which are
+            used by back_prop(), are left untouched. """
+        hidden_layer = self.layer_dict['hidden']
+        output_layer = self.layer_dict['output']
+
+        inputs = np.asarray(input_matrix, dtype=float)
+        self.flush_weights(inputs)
+        bias = np.ones((inputs.shape[0], 1))
+        if self.BIAS_UNITS:
+            inputs = np.hstack((bias, inputs))
+
+        hidden_out = hidden_layer.sigmoid(np.dot(inputs, hidden_layer.weights.T))
+        if self.BIAS_UNITS:
+            hidden_out = np.hstack((bias, hidden_out))
+
+        return output_layer.sigmoid(np.dot(hidden_out, output_layer.weights.T))
+
+    def enable_sparse_traces(self):
+        """ Switches back_prop() to the sparse training path, which only
+            touches the hidden traces and weights of the active inputs.
+            The traces restart from zero. """
+        self.sparse_traces = SparseTraces(self.layer_dict['hidden'], self.input_size, \
+                                            self.output_size, self.LAMBDA, self.ALPHA)
+        self.reset_all_traces()
+
+    def enable_batch_updates(self, batch_size, alpha=ALPHA, beta=BETA):
+        """ Switches back_prop() to mini-batch TD(lambda): the weight updates
+            of batch_size steps, which may span several games, are summed up
+            and applied at once, with learning rates alpha (hidden weights)
+            and beta (output weights). Replaces the sparse training path. """
+        if self.sparse_traces is not None:
+            self.sparse_traces.flush()
+            self.sparse_traces = None
+        self.batch_update = BatchUpdate(self, batch_size, alpha, beta)
+        self.reset_all_traces()
+
+    def flush_weights(self, inputs=None):
+        """ Applies the pending updates of the sparse training path to the
+            hidden weight columns, which are multiplied by nonzero inputs
+            (by any row of a matrix of inputs), or to all columns without
+            inputs. Needed before the hidden weights are read directly. """
+        if self.sparse_traces is None:
+            return
+        if inputs is None:
+            self.sparse_traces.flush()
+            return
+
+        inputs = np.atleast_2d(inputs)
+        columns = np.flatnonzero(np.any(inputs != 0, axis=0))
+        if self.BIAS_UNITS:
+            columns = np.hstack(([0], columns + 1))
+        # the traces cover the first input_size columns
+        self.sparse_traces.flush(columns[columns < self.input_size])
+
+    def enable_activation_cache(self):
+        """ Keeps the activations of chosen boards of the current and the
+            previous ply, see ActivationCache. """
+        self.activation_cache = ActivationCache(self.BIAS_UNITS)
+
+    def enable_cache(self, capacity=EvaluationCache.DEFAULT_CAPACITY):
+        """ Puts an LRU cache in front of get_network_output(). Worthwhile
+            whenever the weights are frozen, eg in evaluation mode. """
+        self.evaluation_cache = EvaluationCache(capacity)
+
+    def get_cached_output(self, key, input_function):
+        """ Returns the network output for the position identified by key.
+            input_function is only called on a cache miss and must return
+            the input vector of the position. Falls back to
+            get_network_output() when no cache is enabled. """
+        cache = self.evaluation_cache
+        if cache is None:
+            return self.get_network_output(input_function())
+
+        output = cache.lookup(key, self.weights_version)
+        if output is None:
+            output = self.get_network_output(input_function())
+            cache.store(key, output, self.weights_version)
+        return output
 
     @staticmethod
     def gradient(value):
@@ -268,6 +792,13 @@ class NeuralNetwork(object):
     def back_prop(self, current_output, expected_output):
         """ Computes eligibility traces and backpropagates an error back
             through the network. """ 
+        if self.batch_update is not None:
+            self.batch_back_prop(current_output, expected_output)
+            return
+        if self.sparse_traces is not None:
+            self.sparse_back_prop(current_output, expected_output)
+            return
+
         # re-referencing attributes here for less typing later
         input_layer = self.layer_dict['input']
         input_out = input_layer.output_values
@@ -307,9 +838,60 @@ class NeuralNetwork(object):
                 # update hidden weights
                 for i in range(self.input_size):
                     hidden_weights[h, i] += self.ALPHA * error[o] * hidden_traces[h, i, o]
+
+        # cached outputs of the old weights are stale now
+        self.weights_version += 1
+
+    def batch_back_prop(self, current_output, expected_output):
+        """ back_prop() of mini-batch TD(lambda), records the step
+            for the next update of the weights, see BatchUpdate. """
+        input_out = self.layer_dict['input'].output_values[:self.input_size]
+        hidden_out = self.layer_dict['hidden'].output_values[:self.hidden_size]
+        output_layer = self.layer_dict['output']
+        output_traces = output_layer.e_traces[:, :self.hidden_size]
+
+        output_gradient = self.gradient(output_layer.output_values[:self.output_size])
+        deltas = output_gradient[None, :] * output_layer.weights[:, :self.hidden_size].T \
+                    * self.gradient(hidden_out)[:, None]
+
+        output_traces *= self.LAMBDA
+        output_traces += output_gradient[:, None] * hidden_out[None, :]
+
+        error = np.asarray(expected_output, dtype=float) - current_output
+        self.batch_update.add_step(deltas, input_out.copy(), error, output_traces)
+
+    def sparse_back_prop(self, current_output, expected_output):
+        """ Vectorized back_prop(), which updates the hidden traces and
+            weights of the active inputs only, see SparseTraces. """
+        input_out = self.layer_dict['input'].output_values[:self.input_size]
+        hidden_out = self.layer_dict['hidden'].output_values[:self.hidden_size]
+        output_layer = self.layer_dict['output']
+        output_weights = output_layer.weights[:, :self.hidden_size]
+        output_traces = output_layer.e_traces[:, :self.hidden_size]
+
+        output_gradient = self.gradient(output_layer.output_values[:self.output_size])
+        # trace increments of the hidden weights per unit of input,
+        # from the weights before this update
+        deltas = output_gradient[None, :] * output_weights.T \
+                    * self.gradient(hidden_out)[:, None]
+
+        output_traces *= self.LAMBDA
+        output_traces += output_gradient[:, None] * hidden_out[None, :]
+
+        error = np.asarray(expected_output, dtype=float) - current_output
+        output_weights += self.BETA * error[:, None] * output_traces
+
+        columns = np.flatnonzero(input_out)
+        self.sparse_traces.update(columns, input_out[columns], deltas, error)
+
+        # cached outputs of the old weights are stale now
+        self.weights_version += 1
         
     def save_network(self):
         """ Save the current state of the network to file. """
+        self.flush_weights()
+        if self.batch_update is not None:
+            self.batch_update.apply()
         # save weights of hidden and output layer
         things_to_save = {  'num_games': self.num_games, \
                             'input_size': self.layer_dict['input'].size, \
@@ -318,13 +900,13 @@ class NeuralNetwork(object):
                             'output_size': self.layer_dict['output'].size, \
                             'output_weights': self.layer_dict['output'].weights}
         
-        with open(self.SAVE_FILE, 'wb') as fhandle:
+        with open(self.save_file, 'wb') as fhandle:
             pickle.dump(things_to_save, fhandle)
             
     def restore_network(self):
         """ Restores the settings of the neural network
             from the provided file. """
-        with open(self.SAVE_FILE, 'rb') as fhandle:
+        with open(self.save_file, 'rb') as fhandle:
             restored_things = pickle.load(fhandle)
         return restored_things
  
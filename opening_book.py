@@ -0,0 +1,150 @@
+import os
+from board import Board, Dice
+from move import BoardFactory
+from player import Player
+try:
+   import cPickle as pickle
+except:
+   import pickle
+
+
+class OpeningBook(object):
+    """ Precomputed moves for the start of a game. Every game starts from the
+        same board with a non-double roll, so the 15 opening moves of each
+        color are computed once from a network. Optionally the replies of
+        the opponent to each of them are added for all 21 rolls.
+        The book remembers the weights it was computed from and rebuilds
+        itself once they change. """
+
+    # filename, where the book is saved
+    SAVE_FILE = 'opening_book.pkl'
+
+    def __init__(self, neural_network, second_moves=False, save_file=SAVE_FILE, \
+                                                            player_options=None):
+        """ player_options are passed on to the Player objects which choose
+            the book moves, eg {'search_plies': 1}. """
+        self.neural_network = neural_network
+        self.second_moves = second_moves
+        self.save_file = save_file
+        self.player_options = player_options or {}
+        # (position ID, color, high die, low die) -> position ID of chosen board
+        self.entries = {}
+        # weights the entries were computed from
+        self.fingerprint = None
+        self.weights_version = None
+
+    @classmethod
+    def load_or_build(cls, neural_network, second_moves=False, save_file=SAVE_FILE, \
+                                                            player_options=None):
+        """ Restores the book from save_file, or builds and saves it when
+            the file is missing or was computed from other weights. """
+        book = cls(neural_network, second_moves, save_file, player_options)
+        if not book.restore():
+            book.build()
+            book.save()
+        return book
+
+    @staticmethod
+    def make_key(board, color, dice):
+        """ Returns the book key of a board, with color to move
+            and the given dice. """
+        return (board.get_position_id(color), color, max(dice.get_dice()), \
+                                                    min(dice.get_dice()))
+
+    def build(self):
+        """ Computes all book moves from the current weights. """
+        self.entries = {}
+        self.fingerprint = self.neural_network.get_weights_fingerprint()
+        self.weights_version = self.neural_network.weights_version
+
+        players = {}
+        for color in (Board.WHITE, Board.BLACK):
+            players[color] = Player(color, self.neural_network, False, \
+                                    **self.player_options)
+
+        start = Board()
+        for color in (Board.WHITE, Board.BLACK):
+            for die1, die2, probability in Dice.distinct_rolls():
+                # the opening roll is never a double
+                if die1 == die2:
+                    continue
+                first_board = self.add_entry(players[color], start, die1, die2)
+
+                if self.second_moves:
+                    opponent = Board.get_opponent(color)
+                    for reply1, reply2, probability in Dice.distinct_rolls():
+                        self.add_entry(players[opponent], first_board, reply1, reply2)
+
+    def add_entry(self, player, board, die1, die2):
+        """ Lets player choose its move for the given board and dice,
+            stores it in the book and returns the chosen board. """
+        dice = Dice()
+        dice.roll(die1, die2)
+        all_boards = BoardFactory.generate_all_boards(player.color, dice, board)
+        best_board = player.find_best_board(all_boards)[0]
+
+        key = self.make_key(board, player.color, dice)
+        self.entries[key] = best_board.get_position_id(player.color)
+        return best_board
+
+    def is_current(self):
+        """ Returns whether the entries were computed from the current
+            weights. The cheap in-process version counter is checked
+            first, the fingerprint only when it has changed. """
+        if self.weights_version == self.neural_network.weights_version:
+            return True
+        if self.fingerprint == self.neural_network.get_weights_fingerprint():
+            self.weights_version = self.neural_network.weights_version
+            return True
+        return False
+
+    def get_depth(self):
+        """ Returns the number of plies of a game the book covers. """
+        return (2 if self.second_moves else 1)
+
+    def lookup(self, board, color, dice):
+        """ Returns the book move of color for the board and dice as a new
+            board, or None if the position is not in the book. """
+        if not self.is_current():
+            self.build()
+            self.save()
+
+        position_id = self.entries.get(self.make_key(board, color, dice))
+        if position_id is None:
+            return None
+        return Board.from_position_id(position_id, color)
+
+    def save(self):
+        """ Save the book and the fingerprint of its weights to file. """
+        things_to_save = {'fingerprint': self.fingerprint, \
+                          'second_moves': self.second_moves, \
+                          'player_options': self.player_options, \
+                          'entries': self.entries}
+
+        with open(self.save_file, 'wb') as fhandle:
+            pickle.dump(things_to_save, fhandle)
+
+    def restore(self):
+        """ Restores the book from file. Returns False when there is no
+            file, or it was computed from other weights or settings. """
+        if not os.path.exists(self.save_file):
+            return False
+
+        with open(self.save_file, 'rb') as fhandle:
+            restored_things = pickle.load(fhandle)
+
+        if (restored_things['fingerprint'] != self.neural_network.get_weights_fingerprint() \
+                or restored_things['second_moves'] != self.second_moves \
+                or restored_things['player_options'] != self.player_options):
+            return False
+
+        self.entries = restored_things['entries']
+        self.fingerprint = restored_things['fingerprint']
+        self.weights_version = self.neural_network.weights_version
+        return True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "Opening Book, {} entries".format(len(self))
@@ -0,0 +1,251 @@
+import multiprocessing
+import socket
+import struct
+import sys
+import threading
+import time
+import SocketServer
+import numpy as np
+from board import Board, DiceStream
+from player import Player
+from neural_net import NeuralNetwork
+from backgammon import Backgammon
+from actor_learner import get_weights, set_weights
+from bgexceptions import ProtocolException
+
+
+# every message starts with: message type, weights version,
+# a count (games or accepted flag) and the payload length in bytes
+HEADER = struct.Struct('!BIII')
+# layer sizes in front of the weights of a WEIGHTS message
+SIZES = struct.Struct('!III')
+# weights and deltas are sent as big-endian doubles
+WEIGHTS_DTYPE = np.dtype('>f8')
+
+PULL = 1
+WEIGHTS = 2
+PUSH = 3
+ACK = 4
+
+
+def send_message(sock, message_type, version=0, count=0, payload=''):
+    sock.sendall(HEADER.pack(message_type, version, count, len(payload)) + payload)
+
+
+def receive_exactly(sock, num_bytes):
+    chunks = []
+    while num_bytes > 0:
+        chunk = sock.recv(min(num_bytes, 1 << 16))
+        if not chunk:
+            raise ProtocolException("Connection closed")
+        chunks.append(chunk)
+        num_bytes -= len(chunk)
+    return ''.join(chunks)
+
+
+def receive_message(sock, expected_type=None):
+    """ Returns (message type, version, count, payload) of the next message. """
+    message_type, version, count, length = HEADER.unpack( \
+                                        receive_exactly(sock, HEADER.size))
+    if expected_type is not None and message_type != expected_type:
+        raise ProtocolException("Expected message %s, got %s" %(expected_type, \
+                                                                message_type))
+    return message_type, version, count, receive_exactly(sock, length)
+
+
+class ParameterHandler(SocketServer.BaseRequestHandler):
+    """ Serves one worker connection, see ParameterServer. """
+
+    def handle(self):
+        while True:
+            try:
+                message_type, version, count, payload = receive_message(self.request)
+            except ProtocolException:
+                break
+
+            if message_type == PULL:
+                version, num_games, payload = self.server.get_weights_message()
+                send_message(self.request, WEIGHTS, version, num_games, payload)
+            elif message_type == PUSH:
+                delta = np.frombuffer(payload, dtype=WEIGHTS_DTYPE)
+                try:
+                    accepted, version = self.server.apply_delta(version, count, delta)
+                except ProtocolException:
+                    # a delta of the wrong shape is rejected like a stale one
+                    accepted, version = False, self.server.version
+                send_message(self.request, ACK, version, int(accepted))
+            else:
+                break
+
+
+class ParameterServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """ Holds the authoritative weights and game counter of a network.
+        Workers pull the weights, train on them locally and push the
+        difference back. A delta computed from weights more than
+        max_staleness versions old is rejected, the worker then pulls
+        the current weights and starts over. The network is saved
+        every save_every accepted deltas. """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, neural_network, max_staleness=4, save_every=None):
+        SocketServer.TCPServer.__init__(self, address, ParameterHandler)
+        self.neural_network = neural_network
+        self.max_staleness = max_staleness
+        self.save_every = save_every
+        self.lock = threading.Lock()
+        self.weights = get_weights(neural_network)
+        self.version = 0
+        # counters
+        self.num_accepted = 0
+        self.num_rejected = 0
+
+    def get_weights_message(self):
+        """ Returns version, game counter and payload of a WEIGHTS message. """
+        network = self.neural_network
+        with self.lock:
+            payload = SIZES.pack(network.input_size, network.hidden_size, \
+                                    network.output_size) + \
+                        self.weights.astype(WEIGHTS_DTYPE).tobytes()
+            return self.version, network.num_games, payload
+
+    def apply_delta(self, base_version, num_games, delta):
+        """ Adds a worker's delta to the weights, unless it is too stale.
+            Returns whether it was accepted and the current version. """
+        with self.lock:
+            if len(delta) != len(self.weights):
+                raise ProtocolException("Delta of %s weights, expected %s" \
+                                                %(len(delta), len(self.weights)))
+            if self.version - base_version > self.max_staleness:
+                self.num_rejected += 1
+                return False, self.version
+
+            self.weights += delta
+            self.version += 1
+            self.num_accepted += 1
+            self.neural_network.num_games += num_games
+            if self.save_every and self.num_accepted % self.save_every == 0:
+                self.save_network()
+            return True, self.version
+
+    def save_network(self):
+        set_weights(self.neural_network, self.weights)
+        self.neural_network.save_network()
+
+    def __repr__(self):
+        return "Parameter Server, version {}, {} games, {} deltas accepted, " \
+               "{} rejected".format(self.version, self.neural_network.num_games, \
+                                    self.num_accepted, self.num_rejected)
+
+
+class ParameterClient(object):
+    """ Connection of a worker to the ParameterServer. """
+
+    def __init__(self, host='localhost', port=8766, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+
+    def pull(self):
+        """ Returns the version, game counter, layer sizes and weights. """
+        send_message(self.sock, PULL)
+        message_type, version, num_games, payload = receive_message(self.sock, WEIGHTS)
+        sizes = SIZES.unpack(payload[:SIZES.size])
+        weights = np.frombuffer(payload[SIZES.size:], dtype=WEIGHTS_DTYPE).astype(float)
+        return version, num_games, sizes, weights
+
+    def push(self, base_version, delta, num_games):
+        """ Sends the weight changes of num_games games trained on weights
+            base_version. Returns whether they were accepted and the
+            current version. """
+        send_message(self.sock, PUSH, base_version, num_games, \
+                        np.asarray(delta, dtype=WEIGHTS_DTYPE).tobytes())
+        message_type, version, accepted, payload = receive_message(self.sock, ACK)
+        return bool(accepted), version
+
+    def close(self):
+        self.sock.close()
+
+
+def run_worker(host, port, num_rounds, games_per_round=10, seed=None):
+    """ Worker loop: pulls the weights, trains games_per_round self-play
+        games on them and pushes the delta, num_rounds times. Returns the
+        number of accepted and rejected deltas. """
+    client = ParameterClient(host, port)
+    stream = DiceStream(seed)
+    network = None
+    accepted_rounds = [0, 0]
+    try:
+        for round_index in range(num_rounds):
+            version, num_games, sizes, weights = client.pull()
+            if network is None:
+                network = NeuralNetwork(*sizes)
+                network.enable_sparse_traces()
+                players = [Player(color, network, learning_mode=True) \
+                                for color in (Board.WHITE, Board.BLACK)]
+                bg = Backgammon(training_mode=True, restore_net=False, players=players, \
+                                seed=stream.seed)
+            set_weights(network, weights)
+
+            for game in range(games_per_round):
+                bg.reset()
+                bg.run()
+
+            accepted, version = client.push(version, get_weights(network) - weights, \
+                                                                    games_per_round)
+            accepted_rounds[0 if accepted else 1] += 1
+    finally:
+        client.close()
+    return accepted_rounds
+
+
+def run_local(num_workers=2, num_rounds=5, games_per_round=10, port=8766, \
+                                                    max_staleness=4, seed=None):
+    """ Runs a server and num_workers localhost worker processes,
+        returns the server once all workers are done. With port 0 the
+        server listens on a free port. """
+    server = ParameterServer(('localhost', port), NeuralNetwork(restore_from_file=True), \
+                                max_staleness)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    port = server.server_address[1]
+
+    seed = (seed if seed is not None else DiceStream().seed)
+    workers = [multiprocessing.Process(target=run_worker, args=('localhost', port, \
+                    num_rounds, games_per_round, DiceStream.derive_seed(seed, worker))) \
+                for worker in range(num_workers)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    server.shutdown()
+    server.server_close()
+    print "%s, %.1f seconds" %(server, time.time() - start)
+    return server
+
+
+if __name__ == '__main__':
+    mode = (sys.argv[1] if len(sys.argv) > 1 else 'local')
+
+    if mode == 'server':
+        port = (int(sys.argv[2]) if len(sys.argv) > 2 else 8766)
+        server = ParameterServer(('', port), NeuralNetwork(restore_from_file=True), \
+                                    save_every=10)
+        print "Serving weights on port %s ..." %(port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.save_network()
+            server.server_close()
+    elif mode == 'worker':
+        host = sys.argv[2]
+        port = (int(sys.argv[3]) if len(sys.argv) > 3 else 8766)
+        num_rounds = (int(sys.argv[4]) if len(sys.argv) > 4 else 100)
+        print "Accepted, rejected deltas: %s" %(run_worker(host, port, num_rounds))
+    else:
+        num_workers = (int(sys.argv[2]) if len(sys.argv) > 2 else 2)
+        num_rounds = (int(sys.argv[3]) if len(sys.argv) > 3 else 5)
+        server = run_local(num_workers, num_rounds)
+        server.save_network()
@@ -1,7 +1,12 @@
 from board import Board, Dice
-from neural_net import NeuralNetwork
+from neural_net import NeuralNetwork, IncrementalEvaluator
 from move import BoardFactory
+from search import ExpectiminimaxSearch
+from evaluators import PhaseDispatcher
+from move_sampler import UniformMoveSampler
+import fast_moves
 import random
+import time
 import numpy as np
 
 
@@ -9,14 +14,44 @@ class Player(object):
     """ Class which represents a backgammon player. """
 
     COLOR_CODE = {'white': Board.WHITE, 'black': Board.BLACK}
+    # encode boards in absolute coordinates by default
+    canonical_inputs = False
 
-    def __init__(self, color, neural_network, learning_mode):
+    def __init__(self, color, neural_network, learning_mode, canonical_inputs=False, \
+                    search_plies=0, max_candidates=ExpectiminimaxSearch.MAX_CANDIDATES, \
+                    move_filters=None, time_budget=None, opening_book=None, \
+                    incremental=False, phase_evaluation=False, stream_chunk_size=None, \
+                    cache_size=None):
         """ Player can be initialized by specifying color:
-            E.g.: 'white' or 0 vs. 'black' or 1. """
+            E.g.: 'white' or 0 vs. 'black' or 1.
+            With search_plies > 0 moves are chosen by an n-ply lookahead,
+            which searches max_candidates boards per node deeper. Per depth,
+            move_filters can map to a search.MoveFilter instead, which
+            promotes the top-k candidates or the ones within an equity
+            window of the best. time_budget limits the seconds a search
+            may take per move. Only the search reads it, without
+            search_plies the boards are all evaluated regardless.
+            Searches evaluate many positions twice, as the replies to
+            different candidates overlap: cache_size enables an evaluation
+            cache of that capacity on the network, which is shared with
+            every other user of the network, so it is opt-in. A frozen
+            player answers the opening from opening_book, an
+            opening_book.OpeningBook, when provided.
+            With incremental, candidates are evaluated relative to the
+            board before the move by a neural_net.IncrementalEvaluator.
+            With phase_evaluation, races and bear-offs are evaluated by the
+            cheaper evaluators of an evaluators.PhaseDispatcher.
+            With stream_chunk_size, the boards of a move are generated
+            lazily and evaluated in chunks of that size, so only one chunk
+            is alive at a time. Not used by the search. """
         self.neural_network = neural_network
         # the mode indicates whether the board backprops errors,
         # or just predicts which boards are best for player
         self.learning_mode = learning_mode
+        # with canonical inputs every board is encoded in the side-to-move
+        # view, ie as if this player was white. One single-perspective
+        # network then serves both colors and both colors share cache entries
+        self.canonical_inputs = canonical_inputs
 
         if type(color) is int:
             self.color = color
@@ -29,37 +64,66 @@ class Player(object):
         else:
             print "Enter valid player: Either 'white' - 0, or 'black' - 1!"
 
-    def choose_move(self, backgammon):
+        # default time budget per move of the search in seconds,
+        # None means unlimited
+        self.time_budget = time_budget
+        # search depth the last move was chosen with
+        self.last_search_depth = 0
+        self.opening_book = opening_book
+        self.incremental_evaluator = (IncrementalEvaluator(neural_network) \
+                                        if incremental else None)
+        self.phase_dispatcher = (PhaseDispatcher(self) if phase_evaluation else None)
+        self.stream_chunk_size = stream_chunk_size
+
+        self.search = None
+        if search_plies > 0:
+            self.search = ExpectiminimaxSearch(self, search_plies, max_candidates, \
+                                                move_filters)
+        if cache_size is not None and self.neural_network.evaluation_cache is None:
+            self.neural_network.enable_cache(cache_size)
+
+    def choose_move(self, backgammon, time_budget=None):
         """ Function passes the list of all possible boards to the net and
             evaluates them. Training can be disabled by the Player class
             parameter - 'learning_mode'. In this case the net only
-            predicts the chances of winning for a board. """
-        
-        best_board = None
-        # the value representing the expected contribution of a distinct
-        # board to win the game
-        expected_utility = -1.0
-        # next_out is the network output of the selected new board
-        next_output = []
+            predicts the chances of winning for a board.
+            time_budget (seconds) overrides the player's default: the
+            search then returns the best board found when time is up.
+            Without a search it has no effect. """
+        if time_budget is None:
+            time_budget = self.time_budget
+        deadline = (time.time() + time_budget if time_budget is not None else None)
+
+        if self.learning_mode and self.neural_network.activation_cache is not None:
+            self.neural_network.activation_cache.next_ply()
+
+        # frozen networks can answer the opening from the book, which
+        # only covers the first plies of a game
+        if self.opening_book is not None and not self.learning_mode and \
+                backgammon.game_record['num_moves'] < self.opening_book.get_depth():
+            book_board = self.opening_book.lookup(backgammon.board, self.color, \
+                                                    backgammon.dice)
+            if book_board is not None:
+                return book_board
 
-        # get all possible boards from BoardFactory
-        all_boards = BoardFactory.generate_all_boards(backgammon.current_player, \
-                                                        backgammon.dice, \
-                                                        backgammon.board)
-
-        # loop over all boards
-        for board in all_boards:
-            board_vector = self.board_to_vector(board)
-            output = self.neural_network.get_network_output(board_vector)
-            # translate network output into an actual meaning for player
-            # eg if output [0.1, 0.3], white odds of winning are lower
-            # than black's odds
-            utility = self.compute_utility(output)
-
-            if utility > expected_utility:
-                best_board = board
-                expected_utility = utility
-                next_output = output
+        # candidates differ from the current board by a few input units
+        if self.incremental_evaluator is not None:
+            self.incremental_evaluator.set_base(self.board_to_vector(backgammon.board))
+
+        if self.stream_chunk_size is not None and self.search is None:
+            board_chunks = BoardFactory.iter_board_chunks(backgammon.current_player, \
+                                                            backgammon.dice, \
+                                                            backgammon.board, \
+                                                            self.stream_chunk_size)
+            best_board, expected_utility, next_output = \
+                                            self.find_best_streamed_board(board_chunks)
+        else:
+            # get all possible boards from BoardFactory
+            all_boards = BoardFactory.generate_all_boards(backgammon.current_player, \
+                                                            backgammon.dice, \
+                                                            backgammon.board)
+            best_board, expected_utility, next_output = self.find_best_board(all_boards, \
+                                                                            deadline)
 
         # learning_mode indicates whether the network propagates back errors
         # or only evaluates boards
@@ -67,12 +131,137 @@ class Player(object):
             current_input = self.board_to_vector(backgammon.board)
             # pass the current board (board before this move is about to happen)
             # to the network
-            current_output = self.neural_network.get_network_output(current_input)
+            current_output = self.neural_network.get_training_output(current_input)
 
             self.neural_network.back_prop(current_output, next_output)
 
         return best_board
 
+    def find_best_board(self, all_boards, deadline=None):
+        """ Returns the best of the provided boards for this player, its
+            expected utility and its network output. """
+        best_board = None
+        # the value representing the expected contribution of a distinct
+        # board to win the game
+        expected_utility = -1.0
+        # next_out is the network output of the selected new board
+        next_output = []
+
+        if self.search is not None:
+            # look ahead: all boards are screened at 0-ply and only the
+            # promoted ones are searched, the output of the chosen board
+            # is still needed for learning
+            best_board, expected_utility = self.search.choose_board(all_boards, deadline)
+            self.last_search_depth = self.search.depth_reached
+            next_output = self.evaluate_board(best_board)
+        else:
+            # loop over all boards
+            for board in all_boards:
+                output = self.evaluate_board(board)
+                # translate network output into an actual meaning for player
+                # eg if output [0.1, 0.3], white odds of winning are lower
+                # than black's odds
+                utility = self.compute_utility(output)
+
+                if utility > expected_utility:
+                    best_board = board
+                    expected_utility = utility
+                    next_output = output
+
+            # the activations of the best board are kept for back_prop(), the
+            # forward pass buffers only hold the ones of the last board
+            network = self.neural_network
+            if self.learning_mode and network.activation_cache is not None \
+                    and best_board is not None:
+                network.get_network_output(self.board_to_vector(best_board))
+                network.activation_cache.store(network.get_activations(), \
+                                                network.weights_version)
+
+        return best_board, expected_utility, next_output
+
+    def find_best_streamed_board(self, board_chunks):
+        """ Version of find_best_board() for the lists of boards of
+            BoardFactory.iter_board_chunks(), each list is evaluated in one
+            batch and dropped before the next one is generated. """
+        best_board = None
+        expected_utility = -1.0
+        next_output = []
+        for chunk in board_chunks:
+            for board, output in zip(chunk, self.evaluate_boards(chunk)):
+                utility = self.compute_utility(output)
+                if utility > expected_utility:
+                    best_board = board
+                    expected_utility = utility
+                    next_output = output
+
+        return best_board, expected_utility, next_output
+
+    def evaluate_board(self, board):
+        """ Returns the output for a board this player might move to, in the
+            format of the network outputs. """
+        if self.phase_dispatcher is not None:
+            return self.phase_dispatcher.get_output(board)
+        return self.evaluate_network_board(board)
+
+    def evaluate_boards(self, boards):
+        """ Batched version of evaluate_board(). """
+        if self.phase_dispatcher is not None:
+            return self.phase_dispatcher.get_outputs(boards)
+        return self.evaluate_network_boards(boards)
+
+    def evaluate_network_board(self, board):
+        """ Returns the network output for a board this player might move to.
+            Goes through the network's evaluation cache, keyed by the
+            position ID and the color of this player. """
+        network = self.neural_network
+        if network.evaluation_cache is None:
+            if self.incremental_evaluator is not None:
+                return self.incremental_evaluator.evaluate(self.board_to_vector(board))
+            return network.get_network_output(self.board_to_vector(board))
+
+        key = (board.get_position_id(self.color), self.get_perspective())
+        return network.get_cached_output(key, lambda: self.board_to_vector(board))
+
+    def evaluate_network_boards(self, boards):
+        """ Batched version of evaluate_network_board(): returns the network outputs
+            for all boards, the ones missing in the cache are computed
+            with a single batched forward pass. """
+        network = self.neural_network
+        cache = network.evaluation_cache
+        outputs = [None] * len(boards)
+        keys = [None] * len(boards)
+        missing = []
+
+        for i, board in enumerate(boards):
+            if cache is not None:
+                keys[i] = (board.get_position_id(self.color), self.get_perspective())
+                outputs[i] = cache.lookup(keys[i], network.weights_version)
+            if outputs[i] is None:
+                missing.append(i)
+
+        if missing:
+            batch = network.get_network_outputs([self.board_to_vector(boards[i]) \
+                                                    for i in missing])
+            for i, output in zip(missing, batch):
+                outputs[i] = output
+                if cache is not None:
+                    cache.store(keys[i], output, network.weights_version)
+
+        return outputs
+
+    def get_opponent_view(self):
+        """ Returns a non-learning player of the other color, which shares
+            the network, encoding and phase evaluators of this player. Used
+            to rate the opponent's replies during a search. """
+        return Player(Board.get_opponent(self.color), self.neural_network, False, \
+                        self.canonical_inputs, \
+                        phase_evaluation=(self.phase_dispatcher is not None))
+
+    def get_perspective(self):
+        """ Returns the color whose view the network inputs and outputs are
+            in: white for canonical inputs, otherwise the own color. """
+        return (Board.WHITE if self.canonical_inputs else self.color)
+
     def compute_utility(self, network_output):
         """ Takes output from the neural net and returns the
             expected utility of a board winning the game. """
@@ -80,7 +269,7 @@ class Player(object):
         
         # check if this player is white, and say no to racism!
         # maybe only use the one output for the specific color
-        if self.color == Board.WHITE:
+        if self.get_perspective() == Board.WHITE:
             # simple average of the probabilities
             # one might also apply Bayes' Rule
             utility = (network_output[0] + (1 - network_output[1])) / 2
@@ -92,7 +281,7 @@ class Player(object):
 
     def lost(self, final_board):
         if self.learning_mode:
-            if self.color == Board.WHITE:
+            if self.get_perspective() == Board.WHITE:
                 # contains the actual reward values
                 # if white has lost, odds are 0.0 and black has won
                 actual_output = [0.0, 1.0]
@@ -101,7 +290,7 @@ class Player(object):
 
             # this is the board that led to the loss/win
             current_input = self.board_to_vector(final_board)
-            current_output = self.neural_network.get_network_output(current_input)
+            current_output = self.neural_network.get_training_output(current_input)
             # backprop the final board
             self.neural_network.back_prop(current_output, actual_output)
             # reset e_traces after each game ended
@@ -109,7 +298,7 @@ class Player(object):
 
     def won(self, final_board):
         if self.learning_mode:
-            if self.color == Board.WHITE:
+            if self.get_perspective() == Board.WHITE:
                 # contains the actual reward values
                 # if white won, odds are 1.0 and black has lost
                 actual_output = [1.0, 0.0]
@@ -118,7 +307,7 @@ class Player(object):
 
             # this is the board that led to the loss/win
             current_input = self.board_to_vector(final_board)
-            current_output = self.neural_network.get_network_output(current_input)
+            current_output = self.neural_network.get_training_output(current_input)
             # backprop the final board
             self.neural_network.back_prop(current_output, actual_output)
             # reset e_traces after each game ended
@@ -130,6 +319,13 @@ class Player(object):
         """ Creates a 198-dimensional input vector
             of the current gammon situation. """
         current_player = self.color
+        if self.canonical_inputs:
+            # encode the side-to-move view with white's turn indicator
+            board_obj = board_obj.get_canonical(self.color)
+            current_player = Board.WHITE
+
+        if fast_moves.USE_KERNELS:
+            return fast_moves.board_to_vector(board_obj, current_player)
         
         board = board_obj.board
         colors = board_obj.colors
@@ -195,9 +391,21 @@ class Player(object):
 class RandomPlayer(Player):
     """ A random player. """
     
-    def __init__(self, color):
+    def __init__(self, color, seed=None, streaming=False, enumerate_boards=False):
         """ Player can be initialized by specifying color:
-            E.g.: 'white' or 0 vs. 'black' or 1. """
+            E.g.: 'white' or 0 vs. 'black' or 1.
+            The move is drawn by a move_sampler.UniformMoveSampler, which
+            picks every distinct board with the same probability without
+            generating all of them. With enumerate_boards, it is chosen
+            from the list of all boards instead, as by earlier versions.
+            With streaming, the boards are generated lazily and the move
+            is picked by reservoir sampling. The three draw different
+            random numbers for the same seed. """
+        # own generator, so that the choices can be replayed
+        self.random = random.Random(seed)
+        self.streaming = streaming
+        self.enumerate_boards = enumerate_boards
+        self.sampler = UniformMoveSampler(self.random)
         
         if type(color) is int:
             self.color = color
@@ -212,14 +420,31 @@ class RandomPlayer(Player):
 
     def choose_move(self, backgammon):
         """ Chooses a random board from all possible boards. """
+        if self.streaming:
+            # every board replaces the pick with probability 1/count
+            random_board = None
+            for count, board in enumerate(BoardFactory.iter_boards( \
+                    backgammon.current_player, backgammon.dice, backgammon.board), 1):
+                if self.random.randrange(count) == 0:
+                    random_board = board
+            return random_board
+
+        if not self.enumerate_boards:
+            return self.sampler.sample(backgammon.current_player, backgammon.dice, \
+                                        backgammon.board)
+
         # get a list of all possible moves
         all_boards = BoardFactory.generate_all_boards(backgammon.current_player,\
                                             backgammon.dice, backgammon.board)
         
         # pick a random move
-        random_board = random.choice(all_boards)
+        random_board = self.random.choice(all_boards)
         return random_board
 
+    def reseed(self, seed):
+        """ Restarts the random choices from seed. """
+        self.random.seed(seed)
+
     def lost(self, board):
         pass
     
@@ -0,0 +1,173 @@
+import time
+from board import Board, Dice
+from move import BoardFactory
+from bgexceptions import SearchTimeoutException
+
+
+class MoveFilter(object):
+    """ Cheap screen in front of a deep evaluation: of the candidates ranked
+        at 0-ply only the best top_k ones, which are within window of the
+        best utility, are promoted. Either limit can be None. """
+
+    def __init__(self, top_k=None, window=None):
+        self.top_k = top_k
+        self.window = window
+
+    def apply(self, boards, utilities):
+        """ Returns the promoted boards, the best one first. """
+        order = sorted(range(len(boards)), key=lambda i: utilities[i], reverse=True)
+        if self.top_k is not None:
+            order = order[:max(self.top_k, 1)]
+        if self.window is not None and order:
+            threshold = utilities[order[0]] - self.window
+            order = [i for i in order if utilities[i] >= threshold]
+        return [boards[i] for i in order]
+
+    def __repr__(self):
+        return "Move Filter, top {}, window {}".format(self.top_k, self.window)
+
+
+class ExpectiminimaxSearch(object):
+    """ n-ply lookahead for move selection. A candidate board is rated by
+        averaging over the 21 distinct rolls of the opponent, weighted by
+        their probability, assuming the opponent picks its best reply.
+        At 1-ply the replies are rated statically by the network, each
+        further ply repeats the averaging for the replies. All boards at
+        the same depth are evaluated with one batched network call.
+        Replies to different candidates overlap, so searches profit from
+        an evaluation cache, see the cache_size option of Player. """
+
+    # default number of candidates per node that are searched deeper
+    MAX_CANDIDATES = 8
+
+    def __init__(self, player, plies, max_candidates=MAX_CANDIDATES, move_filters=None):
+        """ player is the Player whose candidates are searched, plies the
+            depth of the lookahead and max_candidates the number of
+            candidates per node, which are searched deeper. move_filters
+            maps a depth to the MoveFilter, which selects the candidates
+            searched at that depth, and overrides max_candidates. """
+        self.player = player
+        self.plies = plies
+        self.max_candidates = max_candidates
+        self.move_filters = dict((depth, MoveFilter(max_candidates)) \
+                                    for depth in range(1, plies + 1))
+        if move_filters is not None:
+            self.move_filters.update(move_filters)
+        # players evaluating the boards from the view of each color
+        opponent_view = player.get_opponent_view()
+        self.evaluators = {player.color: player, opponent_view.color: opponent_view}
+        # deepest completed iteration of the last choose_board() call
+        self.depth_reached = 0
+        # time.time() after which a running search is aborted
+        self.deadline = None
+        # one Dice object per distinct roll, with its probability
+        self.rolls = []
+        for die1, die2, probability in Dice.distinct_rolls():
+            dice = Dice()
+            dice.roll(die1, die2)
+            self.rolls.append((dice, probability))
+
+    def choose_board(self, boards, deadline=None):
+        """ Returns the best of the given candidate boards of the player
+            and its expected utility. Without a deadline the promoted
+            candidates are searched at full depth right away. With a
+            deadline (a time.time() value) the search deepens iteratively:
+            0-ply first, then each depth for the candidates promoted to it,
+            until the deadline hits. The result of the deepest completed
+            iteration is returned, its depth is kept in depth_reached. """
+        color = self.player.color
+        utilities = self.static_utilities(boards, color)
+        best = max(range(len(boards)), key=lambda i: utilities[i])
+        best_board, best_utility = boards[best], utilities[best]
+        self.depth_reached = 0
+
+        self.deadline = deadline
+        try:
+            for depth in range(1, self.plies + 1):
+                # only deepen iteratively when there is a deadline
+                if deadline is None and depth < self.plies:
+                    continue
+                candidates = self.move_filters[depth].apply(boards, utilities)
+                values = self.expected_utilities(candidates, color, depth)
+                best = max(range(len(candidates)), key=lambda i: values[i])
+                best_board, best_utility = candidates[best], values[best]
+                self.depth_reached = depth
+        except SearchTimeoutException:
+            pass
+        finally:
+            self.deadline = None
+
+        return best_board, best_utility
+
+    def check_deadline(self):
+        """ Aborts the running iteration when the deadline has passed. """
+        if self.deadline is not None and time.time() > self.deadline:
+            raise SearchTimeoutException("Search ran out of time!")
+
+    def expected_utilities(self, boards, mover, plies):
+        """ Returns the expected utility for mover of each board, which
+            is the result of a move of mover, searched plies deep. """
+        if plies == 0:
+            return self.static_utilities(boards, mover)
+
+        opponent = Board.get_opponent(mover)
+        values = [0.0] * len(boards)
+        # each group holds the replies to one board for one roll:
+        # (board index, probability, first reply index, number of replies)
+        groups = []
+        replies = []
+        for i, board in enumerate(boards):
+            if board.is_gameover():
+                values[i] = self.terminal_utility(board, mover)
+                continue
+            for dice, probability in self.rolls:
+                self.check_deadline()
+                boards_for_roll = BoardFactory.generate_all_boards(opponent, dice, board)
+                groups.append((i, probability, len(replies), len(boards_for_roll)))
+                replies.extend(boards_for_roll)
+
+        # rate all replies of this depth at once
+        self.check_deadline()
+        scores = self.static_utilities(replies, opponent)
+
+        if plies > 1:
+            # only search the most promising replies of each group deeper
+            deeper_groups = []
+            deeper_replies = []
+            for i, probability, start, num in groups:
+                best = self.move_filters[plies - 1].apply(replies[start:start + num], \
+                                                        scores[start:start + num])
+                deeper_groups.append((i, probability, len(deeper_replies), len(best)))
+                deeper_replies.extend(best)
+            groups = deeper_groups
+            scores = self.expected_utilities(deeper_replies, opponent, plies - 1)
+
+        # the opponent chooses the reply that is best for itself
+        for i, probability, start, num in groups:
+            values[i] += probability * (1.0 - max(scores[start:start + num]))
+
+        return values
+
+    def static_utilities(self, boards, mover):
+        """ Rates boards at 0-ply from the view of mover with one batched
+            network call. Finished games are rated exactly. """
+        utilities = [None] * len(boards)
+        open_boards = []
+        for i, board in enumerate(boards):
+            if board.is_gameover():
+                utilities[i] = self.terminal_utility(board, mover)
+            else:
+                open_boards.append(i)
+
+        if open_boards:
+            evaluator = self.evaluators[mover]
+            outputs = evaluator.evaluate_boards([boards[i] for i in open_boards])
+            for i, output in zip(open_boards, outputs):
+                utilities[i] = evaluator.compute_utility(output)
+
+        return utilities
+
+    @staticmethod
+    def terminal_utility(board, mover):
+        """ Returns the exact utility of a finished game for mover. """
+        return (1.0 if board.get_winner() == mover else 0.0)
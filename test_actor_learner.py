@@ -0,0 +1,41 @@
+import time
+import unittest
+import numpy as np
+from neural_net import NeuralNetwork
+from actor_learner import ActorLearner
+
+
+class ThrottledLearner(ActorLearner):
+    """ Learner which falls behind the actor, so that the queue fills up. """
+
+    DELAY = 0.5
+
+    def __init__(self, *args, **kwargs):
+        super(ThrottledLearner, self).__init__(*args, **kwargs)
+        self.received = []
+
+    def learn(self, trajectory):
+        time.sleep(self.DELAY)
+        self.received.append(trajectory)
+        super(ThrottledLearner, self).learn(trajectory)
+
+
+class ActorLearnerTest(unittest.TestCase):
+
+    def test_slow_learner_receives_complete_trajectories(self):
+        np.random.seed(0)
+        network = NeuralNetwork(input_size=198, hidden_size=40, output_size=2)
+        learner = ThrottledLearner(network, num_actors=1, queue_size=16, seed=0)
+        learner.run(6)
+
+        self.assertEqual(len(learner.received), 6)
+        for trajectory in learner.received:
+            self.assertIsInstance(trajectory.currents, np.ndarray)
+            self.assertIsInstance(trajectory.chosen, np.ndarray)
+            self.assertEqual(len(trajectory.finals), 2)
+            self.assertTrue(len(trajectory) > 0)
+            self.assertEqual(trajectory.currents.shape, trajectory.chosen.shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
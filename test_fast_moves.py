@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+from board import Board
+from move import BoardFactory
+from player import Player
+from move_sampler import sample_positions
+import fast_moves
+
+
+class FastMovesTest(unittest.TestCase):
+    """ The kernels, compiled when Numba is installed, against the Python code. """
+
+    def setUp(self):
+        fast_moves.disable_kernels()
+        self.positions = sample_positions(400, seed=11)
+
+    def test_boards_match_python_order(self):
+        for player, dice, board in self.positions:
+            expected = BoardFactory.generate_all_boards(player, dice, board)
+            boards = BoardFactory.select_boards(fast_moves.generate_all_boards(player, \
+                                                                        dice, board))
+            self.assertEqual(boards, expected)
+            self.assertEqual([brd.move_steps for brd in boards], \
+                                [brd.move_steps for brd in expected])
+            self.assertEqual([brd.num_moves for brd in boards], \
+                                [brd.num_moves for brd in expected])
+
+    def test_board_to_vector_matches_python(self):
+        players = [Player(color, None, False, canonical_inputs=canonical) \
+                    for color in (Board.WHITE, Board.BLACK) for canonical in (False, True)]
+        for player_color, dice, board in self.positions:
+            for player in players:
+                encoded = (board.get_canonical(player.color) if player.canonical_inputs \
+                            else board)
+                turn = (Board.WHITE if player.canonical_inputs else player.color)
+                np.testing.assert_array_equal(fast_moves.board_to_vector(encoded, turn), \
+                                                player.board_to_vector(board))
+
+
+if __name__ == '__main__':
+    unittest.main()
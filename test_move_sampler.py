@@ -0,0 +1,88 @@
+import random
+import unittest
+from board import Board, Dice
+from move import BoardFactory
+from move_sampler import UniformMoveSampler, chi_square_p_value
+
+
+def make_board(white, black, bar=(0, 0), off=None):
+    """ Returns a board with the checkers of white and black, dicts from
+        point to number of checkers. Missing checkers are borne off. """
+    board = Board()
+    board.board = [0] * Board.NUM_POINTS
+    board.colors = [Board.NEITHER] * Board.NUM_POINTS
+    for color, checkers in ((Board.WHITE, white), (Board.BLACK, black)):
+        for point, num in checkers.items():
+            board.board[point] = num
+            board.colors[point] = color
+    board.bar = list(bar)
+    board.off = [15 - sum(white.values()) - bar[0], 15 - sum(black.values()) - bar[1]]
+    return board
+
+
+def make_dice(die1, die2):
+    dice = Dice()
+    dice.roll(die1, die2)
+    return dice
+
+
+class UniformMoveSamplerTest(unittest.TestCase):
+
+    SAMPLES_PER_BOARD = 30
+    # seeded, so a fixed outcome, which a biased sampler fails by far
+    MIN_P_VALUE = 0.001
+
+    def setUp(self):
+        self.sampler = UniformMoveSampler(random.Random(5))
+
+    def check_uniform(self, player, dice, board):
+        all_boards = BoardFactory.generate_all_boards(player, dice, board)
+        self.assertTrue(len(all_boards) > 1)
+        counts = dict((brd.get_position_key(), 0) for brd in all_boards)
+        for i in range(self.SAMPLES_PER_BOARD * len(all_boards)):
+            key = self.sampler.sample(player, dice, board).get_position_key()
+            self.assertIn(key, counts)
+            counts[key] += 1
+
+        expected = float(self.SAMPLES_PER_BOARD)
+        statistic = sum((count - expected) ** 2 / expected for count in counts.values())
+        self.assertGreater(chi_square_p_value(statistic, len(counts) - 1), \
+                            self.MIN_P_VALUE)
+
+    def test_opening(self):
+        self.check_uniform(Board.WHITE, make_dice(3, 1), Board())
+
+    def test_doubles(self):
+        self.check_uniform(Board.BLACK, make_dice(2, 2), Board())
+
+    def test_bar(self):
+        board = make_board({0: 2, 11: 5, 16: 3, 18: 4}, {23: 2, 12: 5, 7: 3, 5: 3, 3: 2}, \
+                            bar=(1, 0))
+        self.check_uniform(Board.WHITE, make_dice(4, 2), board)
+
+    def test_bearoff(self):
+        board = make_board({18: 2, 19: 3, 20: 1, 22: 2, 23: 1}, {5: 3, 3: 4, 1: 2, 0: 2})
+        self.check_uniform(Board.WHITE, make_dice(6, 3), board)
+        self.check_uniform(Board.WHITE, make_dice(2, 2), board)
+
+    def test_falls_back_to_enumeration(self):
+        self.sampler.MAX_REJECTIONS = 0
+        board = Board()
+        all_boards = BoardFactory.generate_all_boards(Board.WHITE, make_dice(5, 2), board)
+        chosen = self.sampler.sample(Board.WHITE, make_dice(5, 2), board)
+        self.assertIn(chosen, all_boards)
+        self.assertEqual(self.sampler.num_fallbacks, 1)
+        self.assertEqual(self.sampler.num_proposals, 0)
+
+    def test_blocked_roll_falls_back(self):
+        # only the 1 can enter, the 6-6 and the 6 of 6-1 are blocked
+        board = make_board({11: 5, 16: 3, 18: 5}, {1: 2, 2: 2, 3: 2, 4: 2, 5: 2, 12: 3}, \
+                            bar=(2, 0))
+        for dice in (make_dice(6, 6), make_dice(6, 1)):
+            all_boards = BoardFactory.generate_all_boards(Board.WHITE, dice, board)
+            self.assertIn(self.sampler.sample(Board.WHITE, dice, board), all_boards)
+        self.assertEqual(self.sampler.num_fallbacks, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import threading
+import unittest
+import numpy as np
+from neural_net import NeuralNetwork
+from param_server import ParameterServer, ParameterClient, run_local
+
+
+class ParameterServerTest(unittest.TestCase):
+
+    def test_local_workers(self):
+        num_games = NeuralNetwork(restore_from_file=True).num_games
+        server = run_local(num_workers=2, num_rounds=1, games_per_round=1, port=0, \
+                            seed=0)
+        self.assertEqual(server.version, 2)
+        self.assertEqual(server.num_accepted, 2)
+        self.assertEqual(server.num_rejected, 0)
+        self.assertEqual(server.neural_network.num_games, num_games + 2)
+
+    def test_wrong_delta_size_is_rejected(self):
+        server = ParameterServer(('localhost', 0), \
+                    NeuralNetwork(input_size=198, hidden_size=40, output_size=2))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            client = ParameterClient('localhost', server.server_address[1], timeout=10)
+            version, num_games, sizes, weights = client.pull()
+            self.assertEqual(client.push(version, np.zeros(3), 1), (False, 0))
+            # the connection is still served
+            self.assertEqual(client.push(version, np.zeros(len(weights)), 1), (True, 1))
+            client.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
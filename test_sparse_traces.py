@@ -0,0 +1,39 @@
+import unittest
+import numpy as np
+from board import Board
+from player import Player
+from neural_net import NeuralNetwork
+from backgammon import Backgammon
+from actor_learner import get_weights, set_weights
+
+
+def train(network, num_games, seed):
+    """ Trains network by self-play on the seeded games. """
+    players = [Player(color, network, learning_mode=True) \
+                    for color in (Board.WHITE, Board.BLACK)]
+    bg = Backgammon(training_mode=True, restore_net=False, players=players, seed=seed)
+    for game in range(num_games):
+        bg.reset(game_index=game)
+        bg.run()
+
+
+class SparseTracesTest(unittest.TestCase):
+
+    def test_sparse_matches_dense(self):
+        np.random.seed(3)
+        dense = NeuralNetwork(input_size=198, hidden_size=40, output_size=2)
+        sparse = NeuralNetwork(input_size=198, hidden_size=40, output_size=2)
+        set_weights(sparse, get_weights(dense))
+        sparse.enable_sparse_traces()
+
+        train(dense, 2, seed=17)
+        train(sparse, 2, seed=17)
+
+        # the games are long enough for the traces to be rescaled
+        self.assertGreater(sparse.sparse_traces.num_rescales, 0)
+        np.testing.assert_allclose(get_weights(sparse), get_weights(dense), \
+                                    rtol=0, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import glob
+import itertools
+import json
+import math
+import os
+import sys
+from multiprocessing import Pool
+import numpy as np
+from board import Board, DiceStream
+from player import Player
+from neural_net import NeuralNetwork
+from backgammon import Backgammon
+
+
+# networks loaded by this worker process, by checkpoint path
+_networks = {}
+
+
+def load_network(path):
+    """ Returns the network of a checkpoint, every worker
+        process loads each checkpoint only once. """
+    if path not in _networks:
+        _networks[path] = NeuralNetwork(restore_from_file=True, save_file=path)
+    return _networks[path]
+
+
+def play_match(args):
+    """ Worker function: plays num_games games between two checkpoints,
+        changing colors after every game. The dice of game i come from
+        (seed, i). Returns the paths, the number of games won by each
+        checkpoint and the rules of the adjudicated games. """
+    path_a, path_b, num_games, seed, adjudicator = args
+    network_a = load_network(path_a)
+    network_b = load_network(path_b)
+
+    wins = [0, 0]
+    rules = []
+    for game in range(num_games):
+        # checkpoint a plays white in even games and black in odd games
+        color_a = (Board.WHITE if game % 2 == 0 else Board.BLACK)
+        player_a = Player(color_a, network_a, learning_mode=False)
+        player_b = Player(Board.get_opponent(color_a), network_b, learning_mode=False)
+
+        bg = Backgammon(training_mode=False, restore_net=False, \
+                        players=[player_a, player_b], seed=seed, \
+                        adjudicator=adjudicator)
+        bg.reset(game_index=game)
+        winner = bg.run()
+        wins[0 if winner is player_a else 1] += 1
+        if bg.game_record['adjudicated'] is not None:
+            rules.append(bg.game_record['adjudicated'])
+
+    return path_a, path_b, wins[0], wins[1], rules
+
+
+class Tournament(object):
+    """ Round robin between all network checkpoints of a directory. The
+        matches are played in a process pool, every finished match is
+        appended to a results file right away and the ratings file is
+        rewritten, so that partial runs are useful and can be resumed. """
+
+    RESULTS_FILE = 'results.jsonl'
+    RATINGS_FILE = 'ratings.json'
+    # Elo points of a 10:1 odds ratio
+    ELO_SCALE = 400.0
+
+    def __init__(self, directory, games_per_match=100, processes=None, seed=None, \
+                                                                adjudicator=None):
+        self.directory = directory
+        # every match gets its own dice streams derived from this seed
+        self.seed = (seed if seed is not None else DiceStream().seed)
+        self.games_per_match = games_per_match
+        self.processes = processes
+        # rules to end decided games early, passed on to the workers
+        self.adjudicator = adjudicator
+        self.checkpoints = sorted(glob.glob(os.path.join(directory, '*.pkl')))
+        self.results_file = os.path.join(directory, self.RESULTS_FILE)
+        self.ratings_file = os.path.join(directory, self.RATINGS_FILE)
+        # (path a, path b) -> [games won by a, games won by b]
+        self.results = {}
+        # (path a, path b) -> seed of the dice of the match
+        self.seeds = {}
+
+    def restore_results(self):
+        """ Reads the matches finished by an earlier run. """
+        self.results = {}
+        self.seeds = {}
+        if not os.path.exists(self.results_file):
+            return
+        with open(self.results_file) as fhandle:
+            for line in fhandle:
+                if line.strip():
+                    match = json.loads(line)
+                    # results written before the seeds were recorded
+                    # get the seed pending_matches() derives
+                    seed = match.get('seed')
+                    if seed is None:
+                        seed = DiceStream.derive_seed(self.seed, match['a'], match['b'])
+                    self.seeds[(match['a'], match['b'])] = seed
+                    self.add_result(match['a'], match['b'], match['wins_a'], \
+                                                            match['wins_b'])
+
+    def add_result(self, path_a, path_b, wins_a, wins_b):
+        pair = self.results.setdefault((path_a, path_b), [0, 0])
+        pair[0] += wins_a
+        pair[1] += wins_b
+
+    def pending_matches(self):
+        """ Returns all pairings which have not been played yet. """
+        return [(path_a, path_b, self.games_per_match, \
+                    DiceStream.derive_seed(self.seed, path_a, path_b), self.adjudicator) \
+                    for path_a, path_b in itertools.combinations(self.checkpoints, 2) \
+                    if (path_a, path_b) not in self.results]
+
+    def run(self):
+        """ Plays all pending matches and returns the ratings. """
+        self.restore_results()
+        matches = self.pending_matches()
+
+        pool = Pool(self.processes)
+        try:
+            seeds = dict(((path_a, path_b), seed) \
+                            for path_a, path_b, num, seed, adjudicator in matches)
+            for i, result in enumerate(pool.imap_unordered(play_match, matches)):
+                path_a, path_b, wins_a, wins_b, rules = result
+                self.add_result(path_a, path_b, wins_a, wins_b)
+                # the workers count in copies of the adjudicator
+                if self.adjudicator is not None:
+                    for rule in rules:
+                        self.adjudicator.count(rule)
+                self.seeds[(path_a, path_b)] = seeds[(path_a, path_b)]
+                with open(self.results_file, 'a') as fhandle:
+                    fhandle.write(json.dumps({'a': path_a, 'b': path_b, \
+                                    'wins_a': wins_a, 'wins_b': wins_b, \
+                                    'seed': seeds[(path_a, path_b)]}) + '\n')
+                self.save_ratings()
+                Backgammon.progress(i + 1, len(matches), "matches")
+        finally:
+            pool.close()
+            pool.join()
+
+        return self.compute_ratings()
+
+    def compute_ratings(self, iterations=1000, tolerance=1e-9):
+        """ Fits a Bradley-Terry model to the results and returns a list of
+            (checkpoint, Elo rating, half-width of the 95% confidence
+            interval), best first. Ratings are relative to a mean of 0,
+            checkpoints without finished matches are left out. """
+        # only checkpoints with finished matches can be rated
+        played = set(path for pair in self.results for path in pair)
+        checkpoints = [path for path in self.checkpoints if path in played]
+        num = len(checkpoints)
+        index = dict((path, i) for i, path in enumerate(checkpoints))
+        wins = np.zeros((num, num))
+        for (path_a, path_b), (wins_a, wins_b) in self.results.items():
+            if path_a in index and path_b in index:
+                wins[index[path_a], index[path_b]] += wins_a
+                wins[index[path_b], index[path_a]] += wins_b
+        games = wins + wins.T
+        if num == 0:
+            return []
+
+        # minorization-maximization updates of the strengths, with
+        # half a virtual win and loss against each opponent, so that
+        # unbeaten or winless checkpoints keep a finite rating
+        prior = 0.5 * (games > 0)
+        total_wins = (wins + prior).sum(axis=1)
+        strengths = np.ones(num)
+        for iteration in range(iterations):
+            pair_sums = strengths[:, None] + strengths[None, :]
+            denominators = ((games + 2 * prior) / pair_sums).sum(axis=1)
+            new_strengths = total_wins / np.maximum(denominators, 1e-300)
+            new_strengths /= np.exp(np.mean(np.log(new_strengths)))
+            converged = np.max(np.abs(new_strengths - strengths)) < tolerance
+            strengths = new_strengths
+            if converged:
+                break
+
+        # standard errors from the observed Fisher information
+        # of the log-strengths, the mean constraint is handled by pinv
+        log_strengths = np.log(strengths)
+        win_prob = 1.0 / (1.0 + np.exp(log_strengths[None, :] - log_strengths[:, None]))
+        weights = games * win_prob * (1 - win_prob)
+        information = np.diag(weights.sum(axis=1)) - weights
+        covariance = np.linalg.pinv(information)
+        errors = np.sqrt(np.maximum(np.diag(covariance), 0.0))
+
+        scale = self.ELO_SCALE / math.log(10)
+        ratings = [(path, scale * log_strengths[i], 1.96 * scale * errors[i]) \
+                        for path, i in index.items()]
+        return sorted(ratings, key=lambda rating: rating[1], reverse=True)
+
+    def save_ratings(self):
+        """ Writes the current ratings to the ratings file. """
+        ratings = [{'checkpoint': path, 'elo': elo, 'ci95': ci} \
+                        for path, elo, ci in self.compute_ratings()]
+        with open(self.ratings_file, 'w') as fhandle:
+            json.dump(ratings, fhandle, indent=2)
+
+
+if __name__ == '__main__':
+    directory = sys.argv[1]
+    games_per_match = (int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+    processes = (int(sys.argv[3]) if len(sys.argv) > 3 else None)
+    seed = (int(sys.argv[4]) if len(sys.argv) > 4 else None)
+
+    tournament = Tournament(directory, games_per_match, processes, seed)
+    tournament.restore_results()
+    print "\n%s checkpoints, %s matches" %(len(tournament.checkpoints), \
+                                        len(tournament.pending_matches()))
+    ratings = tournament.run()
+
+    print ""
+    for path, elo, ci in ratings:
+        print "%8.1f +- %5.1f  %s" %(elo, ci, os.path.basename(path))